@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+
+import re
+import time
+import operator
+import fnmatch
+from collections import namedtuple, OrderedDict
+from haproxysessionmon.backends.base import StorageBackend
+
+import logging
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    "AlertEngine",
+    "AlertRule",
+    "AlertEvent",
+    "compile_condition",
+    "ALERT_METRICS",
+    "ALERT_STATE_FIRING",
+    "ALERT_STATE_RESOLVED"
+]
+
+ALERT_METRICS = (
+    "sessions",
+    "queued_sessions",
+    "active_backends",
+    "http_4xx",
+    "http_5xx"
+)
+
+# suffix for conditions on the change in a metric since the previous snapshot
+ALERT_DELTA_SUFFIX = "_delta"
+
+ALERT_OPERATORS = {
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<": operator.lt,
+    "<=": operator.le,
+    "==": operator.eq,
+    "!=": operator.ne
+}
+
+ALERT_CONDITION_PATTERN = re.compile(r"^\s*(?P<metric>[a-z0-9_]+)\s*(?P<op>>=|<=|==|!=|>|<)\s*(?P<value>-?[0-9.]+)\s*$")
+
+ALERT_STATE_FIRING = "firing"
+ALERT_STATE_RESOLVED = "resolved"
+
+AlertEvent = namedtuple("AlertEvent", [
+    "server_id",
+    "endpoint",
+    "backend",
+    "sessions",
+    "queued_sessions",
+    "active_backends",
+    "http_4xx",
+    "http_5xx",
+    "alert",
+    "state",
+    "condition",
+    "value"
+])
+
+Condition = namedtuple("Condition", ["metric", "delta", "test", "threshold", "text"])
+
+
+def compile_condition(text):
+    """Compiles a condition of the form "<metric> <operator> <value>" (e.g. "queued_sessions > 50"). The
+    metric may be suffixed with "_delta" to refer to its change since the previous snapshot.
+
+    Raises:
+        ValueError: If the condition cannot be compiled.
+    """
+    m = ALERT_CONDITION_PATTERN.match(text)
+    if m is None:
+        raise ValueError("Invalid condition: {}".format(text))
+    metric, delta = m.group('metric'), False
+    if metric.endswith(ALERT_DELTA_SUFFIX):
+        metric, delta = metric[:-len(ALERT_DELTA_SUFFIX)], True
+    if metric not in ALERT_METRICS:
+        raise ValueError("Unrecognised metric in condition: {}".format(text))
+    try:
+        threshold = float(m.group('value'))
+    except ValueError:
+        raise ValueError("Invalid threshold in condition: {}".format(text))
+    return Condition(metric, delta, ALERT_OPERATORS[m.group('op')], threshold, text.strip())
+
+
+ALERT_PATTERN_WILDCARDS = re.compile(r"[*?\[]")
+
+
+def pattern_prefix(pattern):
+    """Returns the literal prefix of the given pattern, up to its first wildcard (or None if the pattern
+    contains no wildcards)."""
+    m = ALERT_PATTERN_WILDCARDS.search(pattern)
+    return pattern[:m.start()] if m is not None else None
+
+
+class AlertRule(object):
+    """A compiled threshold alerting rule."""
+
+    def __init__(self, name, condition, backends, backend_pattern="*", server_pattern="*", for_ticks=1,
+                 clear_condition=None, clear_ticks=None):
+        """Constructor.
+
+        Args:
+            name: The name of the alert.
+            condition: The condition which triggers the alert.
+            backends: A list containing one or more storage backends to which alert events are to be sent.
+            backend_pattern: A pattern (supporting shell-style wildcards) matching the names of the HAProxy
+                backends to which this rule applies.
+            server_pattern: A pattern matching the IDs of the servers to which this rule applies.
+            for_ticks: The number of consecutive snapshots for which the condition must hold before the alert
+                fires.
+            clear_condition: An optional condition which must hold for the alert to be resolved again (by
+                default, the alert is resolved when its condition no longer holds).
+            clear_ticks: The number of consecutive snapshots for which the clear condition must hold before
+                the alert is resolved (defaults to the same number of ticks as for firing).
+
+        Raises:
+            ValueError: If a condition cannot be compiled, or if events cannot be sent to one of the backends.
+        """
+        self.name = name
+        self.condition = compile_condition(condition)
+        self.clear_condition = compile_condition(clear_condition) if clear_condition is not None else None
+        if self.clear_condition is not None and \
+                (self.clear_condition.metric, self.clear_condition.delta) != \
+                (self.condition.metric, self.condition.delta):
+            raise ValueError("The clear condition for alert \"{}\" must refer to the same metric".format(name))
+        for backend in backends:
+            if backend.stores_snapshots:
+                raise ValueError("Alert \"{}\" cannot send events to {}, which only stores snapshots".format(
+                    name,
+                    type(backend).__name__
+                ))
+        self.backends = backends
+        self.backend_pattern = backend_pattern
+        self.server_pattern = server_pattern
+        self.for_ticks = for_ticks
+        self.clear_ticks = clear_ticks if clear_ticks is not None else for_ticks
+
+    def value(self, metric, previous):
+        value = getattr(metric, self.condition.metric)
+        if not self.condition.delta:
+            return value
+        if previous is None:
+            return None
+        return value - getattr(previous, self.condition.metric)
+
+    def breached(self, value):
+        return self.condition.test(value, self.condition.threshold)
+
+    def cleared(self, value):
+        if self.clear_condition is None:
+            return not self.breached(value)
+        return self.clear_condition.test(value, self.clear_condition.threshold)
+
+
+class AlertState(object):
+
+    __slots__ = ["ticks", "firing", "metric"]
+
+    def __init__(self):
+        self.ticks = 0
+        self.firing = False
+        # the latest metric evaluated against this alert
+        self.metric = None
+
+
+class AlertEngine(StorageBackend):
+    """Evaluates alerting rules against each snapshot as it is stored. Rules are indexed by backend name, so
+    that each row is only evaluated against the rules that match it. Events are only emitted when an alert
+    fires or is resolved. Firing alerts of servers that have not reported within the expiry period are
+    resolved, and the state of those servers is discarded."""
+
+    def __init__(self, rules, expiry=60.0, clock=time.monotonic):
+        self.rules = rules
+        self.expiry = expiry
+        self.clock = clock
+        # backend name -> rules with exactly that backend name
+        self.exact_rules = dict()
+        # literal prefix -> rules with backend name patterns starting with that prefix
+        self.prefix_rules = dict()
+        for rule in rules:
+            prefix = pattern_prefix(rule.backend_pattern)
+            if prefix is None:
+                self.exact_rules.setdefault(rule.backend_pattern, []).append(rule)
+            else:
+                self.prefix_rules.setdefault(prefix, []).append(rule)
+        self.prefix_lengths = sorted(set(len(prefix) for prefix in self.prefix_rules.keys()))
+        self.uses_deltas = any(rule.condition.delta for rule in rules)
+        # (server ID, backend name) -> tuple of matching rules
+        self.matches = dict()
+        # (alert name, server ID, backend name) -> AlertState
+        self.states = dict()
+        # (server ID, backend name) -> previous metric, for delta conditions
+        self.previous = dict()
+        # server ID -> the time of that server's latest snapshot
+        self.last_seen = dict()
+
+    def match(self, server_id, backend):
+        key = (server_id, backend)
+        if key not in self.matches:
+            candidates = list(self.exact_rules.get(backend, []))
+            # only patterns sharing a literal prefix with the backend name need to be matched
+            for length in self.prefix_lengths:
+                if length > len(backend):
+                    break
+                candidates.extend(
+                    rule for rule in self.prefix_rules.get(backend[:length], [])
+                    if fnmatch.fnmatchcase(backend, rule.backend_pattern)
+                )
+            self.matches[key] = tuple(
+                rule for rule in candidates
+                if rule.server_pattern == "*" or fnmatch.fnmatchcase(server_id, rule.server_pattern)
+            )
+        return self.matches[key]
+
+    def evaluate(self, stats):
+        """Evaluates the rules against the given metrics, returning a list of (rule, event) tuples for alerts
+        which have fired or been resolved."""
+        now = self.clock()
+        events = self.expire(now)
+        for metric in stats:
+            self.last_seen[metric.server_id] = now
+            rules = self.match(metric.server_id, metric.backend)
+            if not rules:
+                continue
+            key = (metric.server_id, metric.backend)
+            previous = self.previous.get(key)
+            if self.uses_deltas:
+                self.previous[key] = metric
+
+            for rule in rules:
+                value = rule.value(metric, previous)
+                if value is None:
+                    continue
+                state_key = (rule.name, metric.server_id, metric.backend)
+                state = self.states.get(state_key)
+                if state is None:
+                    if not rule.breached(value):
+                        continue
+                    state = self.states[state_key] = AlertState()
+                state.metric = metric
+
+                if not state.firing:
+                    if not rule.breached(value):
+                        del self.states[state_key]
+                        continue
+                    state.ticks += 1
+                    if state.ticks >= rule.for_ticks:
+                        state.firing, state.ticks = True, 0
+                        events.append((rule, self.create_event(rule, metric, ALERT_STATE_FIRING, value)))
+                elif rule.cleared(value):
+                    state.ticks += 1
+                    if state.ticks >= rule.clear_ticks:
+                        del self.states[state_key]
+                        events.append((rule, self.create_event(rule, metric, ALERT_STATE_RESOLVED, value)))
+                else:
+                    state.ticks = 0
+        return events
+
+    def expire(self, now):
+        """Discards the state of all servers that have not reported within the expiry period, returning a
+        list of (rule, event) tuples resolving their firing alerts."""
+        expired = {server_id for server_id, last_seen in self.last_seen.items() if now - last_seen > self.expiry}
+        if not expired:
+            return []
+        for server_id in expired:
+            del self.last_seen[server_id]
+            logger.info("Discarding the alert state of expired server {}".format(server_id))
+
+        rules = {rule.name: rule for rule in self.rules}
+        events = []
+        for state_key, state in list(self.states.items()):
+            if state_key[1] not in expired:
+                continue
+            del self.states[state_key]
+            if state.firing:
+                rule = rules[state_key[0]]
+                events.append((rule, self.create_event(rule, state.metric, ALERT_STATE_RESOLVED, None)))
+        for key in [key for key in self.matches.keys() if key[0] in expired]:
+            del self.matches[key]
+        for key in [key for key in self.previous.keys() if key[0] in expired]:
+            del self.previous[key]
+        return events
+
+    def create_event(self, rule, metric, state, value):
+        logger.info("Alert {} {} for backend {} on server {} ({}: {})".format(
+            rule.name,
+            state,
+            metric.backend,
+            metric.server_id,
+            rule.condition.text,
+            value
+        ))
+        return AlertEvent(
+            metric.server_id,
+            metric.endpoint,
+            metric.backend,
+            metric.sessions,
+            metric.queued_sessions,
+            metric.active_backends,
+            metric.http_4xx,
+            metric.http_5xx,
+            rule.name,
+            state,
+            rule.condition.text,
+            value
+        )
+
+    async def store_stats(self, stats):
+        events = self.evaluate(stats)
+        if not events:
+            return 0
+
+        # deliver each backend's events in a single batch
+        batches = OrderedDict()
+        for rule, event in events:
+            for backend in rule.backends:
+                batches.setdefault(id(backend), (backend, []))[1].append(event)
+
+        stored = 0
+        for backend, batch in batches.values():
+            stored += (await backend.store_stats(batch)) or 0
+        return stored
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+
+import gzip
+import json
+import struct
+import time
+import functools
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import logging
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    "StatsArchiveWriter",
+    "StatsArchiveReader",
+    "StatsArchiveRecord",
+    "ReplayClock"
+]
+
+# each index entry holds the offset and length of a record in the archive, and the record's timestamp
+ARCHIVE_INDEX_ENTRY = struct.Struct(">QId")
+ARCHIVE_INDEX_SUFFIX = ".idx"
+
+StatsArchiveRecord = namedtuple("StatsArchiveRecord", [
+    "timestamp",
+    "server_id",
+    "endpoint",
+    "csv_data"
+])
+
+
+class ReplayClock(object):
+    """A clock for time-based backends which follows the timestamps of the records being replayed, rather
+    than the wall clock, so that their windows and intervals behave as they did while recording."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class StatsArchiveWriter(object):
+    """Appends raw stats responses to a compressed archive. Each record is stored as its own gzip member
+    (so the archive as a whole remains readable by standard gzip tools), and a fixed-size entry for each
+    record is appended to an accompanying index file, allowing the archive to be searched by timestamp.
+    Records can be compressed and written on a background thread, to keep this work off the event loop."""
+
+    def __init__(self, path, compresslevel=6):
+        self.path = path
+        self.compresslevel = compresslevel
+        self.archive = open(path, "a+b")
+        self.index = open(path + ARCHIVE_INDEX_SUFFIX, "a+b")
+        self.recover()
+        # a single thread keeps records in the order in which they were submitted
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        logger.info("Recording raw stats responses to {}".format(path))
+
+    def recover(self):
+        """Discards anything written after the last complete record (e.g. if the process was killed while
+        recording), so that new records are appended at the right offsets."""
+        self.index.seek(0, 2)
+        index_size = self.index.tell()
+        self.archive.seek(0, 2)
+        archive_size = self.archive.tell()
+
+        entries = index_size // ARCHIVE_INDEX_ENTRY.size
+        archive_end = 0
+        while entries > 0:
+            self.index.seek((entries - 1) * ARCHIVE_INDEX_ENTRY.size)
+            offset, length, _ = ARCHIVE_INDEX_ENTRY.unpack(self.index.read(ARCHIVE_INDEX_ENTRY.size))
+            if offset + length <= archive_size:
+                archive_end = offset + length
+                break
+            entries -= 1
+
+        if entries * ARCHIVE_INDEX_ENTRY.size != index_size or archive_end != archive_size:
+            logger.warning("Discarding incomplete records at the end of archive {}".format(self.path))
+            self.index.truncate(entries * ARCHIVE_INDEX_ENTRY.size)
+            self.archive.truncate(archive_end)
+        self.index.seek(0, 2)
+        self.archive.seek(0, 2)
+
+    def record(self, server_id, endpoint, csv_data, timestamp=None):
+        timestamp = time.time() if timestamp is None else timestamp
+        header = json.dumps({
+            "timestamp": timestamp,
+            "server_id": server_id,
+            "endpoint": endpoint
+        }).encode("utf-8")
+        payload = gzip.compress(header + b"\n" + csv_data.encode("utf-8"), compresslevel=self.compresslevel)
+
+        offset = self.archive.tell()
+        self.archive.write(payload)
+        self.archive.flush()
+        # the index entry is only written once its record is complete
+        self.index.write(ARCHIVE_INDEX_ENTRY.pack(offset, len(payload), timestamp))
+        self.index.flush()
+
+    def submit(self, server_id, endpoint, csv_data, timestamp=None):
+        """Records the given response on the writer's background thread, returning a
+        concurrent.futures.Future."""
+        timestamp = time.time() if timestamp is None else timestamp
+        future = self.executor.submit(functools.partial(self.record, server_id, endpoint, csv_data,
+                                                        timestamp=timestamp))
+        future.add_done_callback(self.record_done)
+        return future
+
+    def record_done(self, future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.error("Failed to record stats response to {}: {}".format(self.path, future.exception()))
+
+    def close(self):
+        # finish writing any submitted records first
+        self.executor.shutdown(wait=True)
+        self.archive.close()
+        self.index.close()
+
+
+class StatsArchiveReader(object):
+    """Reads records back from an archive written by a StatsArchiveWriter."""
+
+    def __init__(self, path):
+        self.path = path
+        self.archive = open(path, "rb")
+        self.index = open(path + ARCHIVE_INDEX_SUFFIX, "rb")
+
+    def __len__(self):
+        self.index.seek(0, 2)
+        # ignore any partially written trailing entry (which the writer discards when reopening the archive)
+        return self.index.tell() // ARCHIVE_INDEX_ENTRY.size
+
+    def __iter__(self):
+        return self.iter_records()
+
+    def index_entry(self, i):
+        self.index.seek(i * ARCHIVE_INDEX_ENTRY.size)
+        return ARCHIVE_INDEX_ENTRY.unpack(self.index.read(ARCHIVE_INDEX_ENTRY.size))
+
+    def find(self, timestamp):
+        """Returns the position of the first record with a timestamp at or after the given timestamp."""
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.index_entry(mid)[2] < timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def read(self, i):
+        offset, length, _ = self.index_entry(i)
+        self.archive.seek(offset)
+        header, csv_data = gzip.decompress(self.archive.read(length)).split(b"\n", 1)
+        header = json.loads(header.decode("utf-8"))
+        return StatsArchiveRecord(
+            timestamp=header['timestamp'],
+            server_id=header['server_id'],
+            endpoint=header['endpoint'],
+            csv_data=csv_data.decode("utf-8")
+        )
+
+    def iter_records(self, start=None, end=None):
+        """Iterates through the records in the archive, optionally only those with timestamps from the given
+        start time and before the given end time."""
+        count = len(self)
+        i = 0 if start is None else self.find(start)
+        while i < count:
+            record = self.read(i)
+            if end is not None and record.timestamp >= end:
+                break
+            yield record
+            i += 1
+
+    def close(self):
+        self.archive.close()
+        self.index.close()
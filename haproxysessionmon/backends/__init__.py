@@ -1,4 +1,8 @@
 # -*- coding: utf-8 -*-
 
+from haproxysessionmon.backends.aggregate import *
 from haproxysessionmon.backends.graylog import *
 from haproxysessionmon.backends.logfile import *
+from haproxysessionmon.backends.shm import *
+from haproxysessionmon.backends.stream import *
+from haproxysessionmon.backends.summary import *
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+
+import time
+from collections import namedtuple
+from haproxysessionmon.backends.base import ForwardingBackend
+
+import logging
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    "FleetAggregateBackend",
+    "AggregatedProxyMetrics",
+    "AGGREGATED_FIELDS"
+]
+
+AGGREGATED_FIELDS = (
+    "sessions",
+    "queued_sessions",
+    "active_backends",
+    "http_4xx",
+    "http_5xx"
+)
+
+# the standard metric fields carry the fleet-wide sums, with the per-node extremes alongside them
+AggregatedProxyMetrics = namedtuple("AggregatedProxyMetrics", (
+    ("server_id", "endpoint", "backend") +
+    AGGREGATED_FIELDS +
+    ("nodes",) +
+    tuple("{}_max".format(field) for field in AGGREGATED_FIELDS) +
+    tuple("{}_min".format(field) for field in AGGREGATED_FIELDS)
+))
+
+
+class FleetAggregateBackend(ForwardingBackend):
+    """Joins the latest snapshots from many HAProxy servers by backend name, emitting a single aggregated
+    row per backend per interval to the downstream storage backends."""
+
+    def __init__(self, id, backends, update_interval=10.0, expiry=30.0, clock=time.monotonic):
+        """Constructor.
+
+        Args:
+            id: The server ID to report for the aggregated metrics.
+            backends: A list containing one or more storage backends to which the aggregated metrics are
+                to be sent.
+            update_interval: The interval, in seconds, between each emission of aggregated metrics.
+            expiry: The time, in seconds, after which a server that has stopped reporting no longer
+                contributes to the aggregates.
+            clock: A callable returning the current time, in seconds.
+        """
+        super(FleetAggregateBackend, self).__init__(backends)
+        self.id = id
+        self.update_interval = update_interval
+        self.expiry = expiry
+        self.clock = clock
+        self.next_emit = None
+        # backend name -> {server ID: tuple of field values}
+        self.contributions = dict()
+        # backend name -> list of running sums, one per aggregated field
+        self.totals = dict()
+        # server ID -> (time of last snapshot, set of backend names in that snapshot)
+        self.servers = dict()
+
+    async def store_stats(self, stats):
+        now = self.clock()
+        snapshots = dict()
+        for metric in stats:
+            snapshots.setdefault(metric.server_id, []).append(metric)
+        for server_id, metrics in snapshots.items():
+            self.update_server(server_id, metrics, now)
+
+        if self.next_emit is None:
+            self.next_emit = now + self.update_interval
+        if now < self.next_emit:
+            return 0
+
+        self.next_emit = now + self.update_interval
+        return await self.forward(self.aggregate(now))
+
+    async def flush(self):
+        if not self.contributions:
+            return 0
+        self.next_emit = None
+        return await self.forward(self.aggregate(self.clock()))
+
+    def update_server(self, server_id, metrics, now):
+        """Replaces the given server's contribution to the aggregates with its latest snapshot."""
+        reported = set()
+        for metric in metrics:
+            self.add_contribution(metric.backend, server_id, tuple(getattr(metric, f) for f in AGGREGATED_FIELDS))
+            reported.add(metric.backend)
+
+        if server_id in self.servers:
+            # backends which have disappeared from this server's snapshot
+            for backend in self.servers[server_id][1] - reported:
+                self.remove_contribution(backend, server_id)
+        self.servers[server_id] = (now, reported)
+
+    def add_contribution(self, backend, server_id, values):
+        contributions = self.contributions.setdefault(backend, dict())
+        totals = self.totals.setdefault(backend, [0] * len(AGGREGATED_FIELDS))
+        previous = contributions.get(server_id)
+        for i, value in enumerate(values):
+            totals[i] += value - (previous[i] if previous is not None else 0)
+        contributions[server_id] = values
+
+    def remove_contribution(self, backend, server_id):
+        contributions = self.contributions.get(backend, dict())
+        previous = contributions.pop(server_id, None)
+        if previous is None:
+            return
+        if not contributions:
+            del self.contributions[backend]
+            del self.totals[backend]
+            return
+        totals = self.totals[backend]
+        for i, value in enumerate(previous):
+            totals[i] -= value
+
+    def expire(self, now):
+        """Removes the contributions of all servers that have not reported within the expiry period."""
+        for server_id, (last_seen, backends) in list(self.servers.items()):
+            if now - last_seen > self.expiry:
+                logger.info("Server {} has stopped reporting to aggregate {}, expiring its metrics".format(
+                    server_id,
+                    self.id
+                ))
+                for backend in backends:
+                    self.remove_contribution(backend, server_id)
+                del self.servers[server_id]
+
+    def aggregate(self, now):
+        self.expire(now)
+        result = []
+        for backend in sorted(self.contributions.keys()):
+            contributions = list(self.contributions[backend].values())
+            columns = list(zip(*contributions))
+            result.append(AggregatedProxyMetrics._make(
+                (self.id, None, backend) +
+                tuple(self.totals[backend]) +
+                (len(contributions),) +
+                tuple(max(column) for column in columns) +
+                tuple(min(column) for column in columns)
+            ))
+        return result
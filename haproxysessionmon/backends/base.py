@@ -1,12 +1,40 @@
 # -*- coding: utf-8 -*-
 
 __all__ = [
-    "StorageBackend"
+    "StorageBackend",
+    "ForwardingBackend"
 ]
 
 
 class StorageBackend(object):
     """Base class for storage backends."""
 
+    # whether this backend treats each batch of stats as the complete snapshot of the servers in it (in which
+    # case it cannot receive anything else, such as alert events)
+    stores_snapshots = False
+
     async def store_stats(self, stats):
         raise NotImplementedError
+
+
+class ForwardingBackend(StorageBackend):
+    """Base class for processing stages which receive statistics in the same way as a storage backend,
+    but pass their own derived metrics on to one or more downstream storage backends."""
+
+    stores_snapshots = True
+
+    def __init__(self, backends):
+        self.backends = backends
+
+    async def forward(self, stats):
+        if not stats:
+            return 0
+        stored = 0
+        for backend in self.backends:
+            stored += (await backend.store_stats(stats)) or 0
+        return stored
+
+    async def flush(self):
+        """Forwards any derived metrics which are still pending (e.g. at the end of a replay), rather than
+        waiting for the next interval."""
+        return 0
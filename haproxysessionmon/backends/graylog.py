@@ -82,6 +82,10 @@ class GraylogProtocol(object):
             "_http_4xx": metric.http_4xx,
             "_http_5xx": metric.http_5xx
         }
+        # pass through any additional fields from derived metrics (e.g. aggregates)
+        for field in metric._fields:
+            if field not in ("server_id", "endpoint") and "_" + field not in payload:
+                payload["_" + field] = getattr(metric, field)
         self.transport.sendto(json.dumps(payload).encode())
 
     def error_received(self, exc):
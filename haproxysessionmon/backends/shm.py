@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+
+from haproxysessionmon.backends.base import StorageBackend
+from haproxysessionmon.shm import SharedSnapshotWriter, SHM_DEFAULT_CAPACITY, SHM_DEFAULT_EXPIRY
+
+__all__ = [
+    "SharedMemoryBackend"
+]
+
+
+class SharedMemoryBackend(StorageBackend):
+    """Publishes the latest metrics for every server to a memory-mapped file, for local processes to read
+    using a SharedSnapshotReader."""
+
+    stores_snapshots = True
+
+    def __init__(self, path, capacity=SHM_DEFAULT_CAPACITY, expiry=SHM_DEFAULT_EXPIRY):
+        self.writer = SharedSnapshotWriter(path, capacity=capacity, expiry=expiry)
+
+    async def store_stats(self, stats):
+        self.writer.publish(stats)
+        return len(stats)
+
+    def close(self):
+        self.writer.close()
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+from aiohttp import web, WSMsgType
+from haproxysessionmon.backends.base import StorageBackend
+from haproxysessionmon.broadcast import SnapshotBroadcaster
+
+import logging
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    "StreamingBackend"
+]
+
+
+async def stream_websocket(ws, subscription, receiver):
+    """Sends the subscription's frames to a WebSocket subscriber until it disconnects (i.e. until the
+    receiver, which reads the subscriber's messages, finishes). Each frame is drained before the next is
+    fetched, so that frames for slow subscribers are coalesced by their subscription rather than piling up
+    in the transport."""
+    while not ws.closed and not receiver.done():
+        frame = asyncio.ensure_future(subscription.get())
+        await asyncio.wait([frame, receiver], return_when=asyncio.FIRST_COMPLETED)
+        if not frame.done():
+            frame.cancel()
+            break
+        ws.send_str(frame.result())
+        await ws.drain()
+
+
+async def stream_events(response, subscription):
+    """Sends the subscription's frames to a Server-Sent Events subscriber, draining each frame before the
+    next is fetched."""
+    while True:
+        frame = await subscription.get()
+        response.write("data: {}\n\n".format(frame).encode("utf-8"))
+        await response.drain()
+
+
+class StreamingBackend(StorageBackend):
+    """Pushes each new snapshot to live subscribers over WebSockets (at /ws) or Server-Sent Events (at
+    /events). Subscribers receive a full snapshot first, followed by only the rows that change, and can
+    filter by server ID and backend name using the "server" and "backend" query parameters."""
+
+    stores_snapshots = True
+
+    def __init__(self, host, port, loop, max_pending=100, expiry=60.0):
+        self.host = host
+        self.port = port
+        self.loop = loop
+        self.broadcaster = SnapshotBroadcaster(max_pending=max_pending, expiry=expiry)
+
+        self.app = web.Application(loop=loop)
+        self.app.router.add_get("/ws", self.handle_websocket)
+        self.app.router.add_get("/events", self.handle_events)
+        self.handler = self.app.make_handler()
+
+        logger.debug("Starting streaming server at {}:{}".format(host, port))
+        self.server = loop.run_until_complete(loop.create_server(self.handler, host, port))
+
+    async def store_stats(self, stats):
+        self.broadcaster.publish(stats)
+        return len(stats)
+
+    def subscribe(self, request):
+        return self.broadcaster.subscribe(
+            servers=request.query.getall("server", []),
+            backends=request.query.getall("backend", [])
+        )
+
+    async def handle_websocket(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        subscription = self.subscribe(request)
+        logger.debug("WebSocket subscriber connected from {}".format(request.remote))
+
+        async def receive():
+            # the client does not send us anything, but close frames need to be read
+            async for msg in ws:
+                if msg.type in (WSMsgType.CLOSE, WSMsgType.ERROR):
+                    break
+
+        receiver = asyncio.ensure_future(receive(), loop=self.loop)
+        try:
+            await stream_websocket(ws, subscription, receiver)
+        finally:
+            subscription.close()
+            receiver.cancel()
+            logger.debug("WebSocket subscriber disconnected from {}".format(request.remote))
+        return ws
+
+    async def handle_events(self, request):
+        response = web.StreamResponse(headers={
+            "Content-Type": "text/event-stream",
+            "Cache-Control": "no-cache"
+        })
+        await response.prepare(request)
+        subscription = self.subscribe(request)
+        logger.debug("Event stream subscriber connected from {}".format(request.remote))
+        try:
+            await stream_events(response, subscription)
+        except ConnectionError:
+            pass
+        finally:
+            subscription.close()
+            logger.debug("Event stream subscriber disconnected from {}".format(request.remote))
+        return response
+
+    def close(self):
+        self.server.close()
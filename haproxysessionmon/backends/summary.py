@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+
+import json
+import time
+from collections import namedtuple
+from haproxysessionmon.backends.base import ForwardingBackend
+from haproxysessionmon.sketches import QuantileSketch
+
+import logging
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    "SummaryBackend",
+    "merge_summary_sketches",
+    "SUMMARISED_FIELDS"
+]
+
+# the fields for which quantiles are estimated
+SUMMARISED_FIELDS = (
+    "sessions",
+    "queued_sessions",
+    "active_backends"
+)
+
+# cumulative counters, for which only the latest value in each window is reported
+COUNTER_FIELDS = (
+    "http_4xx",
+    "http_5xx"
+)
+
+
+def quantile_field_name(field, q):
+    return "{}_p{}".format(field, "{:g}".format(q * 100).replace(".", "_"))
+
+
+def merge_summary_sketches(rows):
+    """Merges the serialised sketches carried by the given summary rows (e.g. the rows emitted by the summary
+    backends of several workers for the same backend and window).
+
+    Returns:
+        A dictionary mapping each summarised field name to the merged QuantileSketch for that field.
+    """
+    merged = dict()
+    for row in rows:
+        for field, d in json.loads(row.sketches).items():
+            sketch = QuantileSketch.from_dict(d)
+            if field in merged:
+                merged[field].merge(sketch)
+            else:
+                merged[field] = sketch
+    return merged
+
+
+class SummaryBackend(ForwardingBackend):
+    """Summarises each series of metrics over a time window using quantile sketches, emitting a single
+    summary row per series per window to the downstream storage backends."""
+
+    def __init__(self, id, backends, window=60.0, quantiles=(0.5, 0.95, 0.99), relative_accuracy=0.01,
+                 max_bins=2048, merge_servers=False, clock=time.monotonic):
+        """Constructor.
+
+        Args:
+            id: The server ID to report for summaries when merging the metrics of all servers.
+            backends: A list containing one or more storage backends to which the summaries are to be sent.
+            window: The length of each summary window, in seconds.
+            quantiles: The quantiles (between 0 and 1) to report for each of the summarised fields.
+            relative_accuracy: The relative accuracy of the quantile estimates.
+            max_bins: The maximum number of bins kept by each quantile sketch.
+            merge_servers: If True, series are keyed by backend name alone, merging the metrics from all
+                servers. Otherwise, series are keyed by server ID and backend name.
+            clock: A callable returning the current time, in seconds.
+        """
+        super(SummaryBackend, self).__init__(backends)
+        self.id = id
+        self.window = window
+        self.quantiles = tuple(quantiles)
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max_bins
+        self.merge_servers = merge_servers
+        self.clock = clock
+        self.window_end = None
+        # (server ID, backend name) -> (latest metric, list of sketches, one per summarised field)
+        self.series = dict()
+        # the standard metric fields carry the maximum (or latest counter value, for a single server) over
+        # the window
+        self.metrics_type = namedtuple("MetricsSummary", (
+            ("server_id", "endpoint", "backend") +
+            SUMMARISED_FIELDS +
+            COUNTER_FIELDS +
+            ("samples", "sketches") +
+            tuple(quantile_field_name(field, q) for field in SUMMARISED_FIELDS for q in self.quantiles)
+        ))
+
+    async def store_stats(self, stats):
+        now = self.clock()
+        for metric in stats:
+            self.add_metric(metric)
+
+        if self.window_end is None:
+            self.window_end = now + self.window
+        if now < self.window_end:
+            return 0
+
+        self.window_end = now + self.window
+        return await self.forward(self.summarise())
+
+    async def flush(self):
+        self.window_end = None
+        return await self.forward(self.summarise())
+
+    def encode_sketches(self, sketches):
+        # the sketches themselves are emitted (as JSON) so that summaries can be merged downstream
+        return json.dumps({field: sketch.to_dict() for field, sketch in zip(SUMMARISED_FIELDS, sketches)},
+                          sort_keys=True)
+
+    def new_sketch(self):
+        return QuantileSketch(relative_accuracy=self.relative_accuracy, max_bins=self.max_bins)
+
+    def add_metric(self, metric):
+        key = (self.id if self.merge_servers else metric.server_id, metric.backend)
+        if key in self.series:
+            sketches = self.series[key][1]
+        else:
+            sketches = [self.new_sketch() for _ in SUMMARISED_FIELDS]
+        for sketch, field in zip(sketches, SUMMARISED_FIELDS):
+            sketch.add(getattr(metric, field))
+        self.series[key] = (metric, sketches)
+
+    def summarise(self):
+        """Produces the summaries for the current window, and starts a new window."""
+        result = []
+        for (server_id, backend) in sorted(self.series.keys()):
+            latest, sketches = self.series[(server_id, backend)]
+            result.append(self.metrics_type._make(
+                (server_id, None if self.merge_servers else latest.endpoint, backend) +
+                tuple(sketch.max for sketch in sketches) +
+                tuple(None if self.merge_servers else getattr(latest, field) for field in COUNTER_FIELDS) +
+                (sketches[0].count, self.encode_sketches(sketches)) +
+                tuple(sketch.quantile(q) for sketch in sketches for q in self.quantiles)
+            ))
+        self.series = dict()
+        return result
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+
+import json
+import time
+import asyncio
+from collections import OrderedDict, deque
+
+import logging
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    "SnapshotBroadcaster",
+    "Subscription"
+]
+
+
+def encode_metric(metric):
+    return json.dumps(OrderedDict(zip(metric._fields, metric)))
+
+
+def encode_frame(frame_type, encoded_rows, server_id=None, removed=None):
+    # rows are encoded once when published, so frames are assembled from their encodings
+    return "{{\"type\": {}{}, \"rows\": [{}]{}}}".format(
+        json.dumps(frame_type),
+        ", \"server_id\": {}".format(json.dumps(server_id)) if server_id is not None else "",
+        ", ".join(encoded_rows),
+        ", \"removed\": {}".format(json.dumps(removed)) if removed is not None else ""
+    )
+
+
+class Subscription(object):
+    """A single subscriber's view of the published snapshots, optionally filtered by server ID and backend
+    name. Frames are queued up to a maximum, beyond which they are coalesced into a fresh full snapshot."""
+
+    def __init__(self, broadcaster, servers=None, backends=None, max_pending=100):
+        self.broadcaster = broadcaster
+        self.servers = set(servers) if servers else None
+        self.backends = set(backends) if backends else None
+        self.max_pending = max_pending
+        self.pending = deque()
+        self.event = asyncio.Event()
+        # the first frame is always a full snapshot
+        self.resync = True
+        self.event.set()
+        self.coalesced = 0
+
+    @property
+    def filter_key(self):
+        return frozenset(self.backends) if self.backends is not None else None
+
+    def wants_server(self, server_id):
+        return self.servers is None or server_id in self.servers
+
+    def wants_backend(self, backend):
+        return self.backends is None or backend in self.backends
+
+    def push(self, frame):
+        if self.resync:
+            # a full snapshot is already due, which will include this update
+            return
+        if len(self.pending) >= self.max_pending:
+            self.pending.clear()
+            self.resync = True
+            self.coalesced += 1
+        else:
+            self.pending.append(frame)
+        self.event.set()
+
+    async def get(self):
+        """Waits for, and returns, the next frame for this subscriber."""
+        while True:
+            if self.resync:
+                self.resync = False
+                self.pending.clear()
+                return self.broadcaster.snapshot_frame(self)
+            if self.pending:
+                return self.pending.popleft()
+            self.event.clear()
+            await self.event.wait()
+
+    def close(self):
+        self.broadcaster.unsubscribe(self)
+
+
+class SnapshotBroadcaster(object):
+    """Keeps the latest snapshot of each server's metrics, and fans out the rows which change with each new
+    snapshot to any number of subscribers. Publishing never waits on subscribers. The rows of servers that
+    have not published within the expiry period are removed."""
+
+    def __init__(self, max_pending=100, expiry=60.0, clock=time.monotonic):
+        self.max_pending = max_pending
+        self.expiry = expiry
+        self.clock = clock
+        # server ID -> {backend name: (metric, encoded metric)}
+        self.rows = OrderedDict()
+        # server ID -> the time of that server's latest snapshot
+        self.last_seen = dict()
+        self.subscriptions = set()
+
+    def subscribe(self, servers=None, backends=None):
+        subscription = Subscription(self, servers=servers, backends=backends, max_pending=self.max_pending)
+        self.subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self.subscriptions.discard(subscription)
+
+    def publish(self, stats):
+        now = self.clock()
+        self.expire(now)
+        snapshots = OrderedDict()
+        for metric in stats:
+            snapshots.setdefault(metric.server_id, []).append(metric)
+        for server_id, metrics in snapshots.items():
+            self.publish_server(server_id, metrics)
+            self.last_seen[server_id] = now
+
+    def expire(self, now):
+        """Removes the rows of all servers that have not published within the expiry period, telling
+        subscribers that they have been removed."""
+        for server_id, last_seen in list(self.last_seen.items()):
+            if now - last_seen > self.expiry:
+                removed = list(self.rows.pop(server_id).keys())
+                del self.last_seen[server_id]
+                logger.info("Removed expired server {} from the published snapshots".format(server_id))
+                self.push_update(server_id, dict(), [], removed)
+
+    def publish_server(self, server_id, metrics):
+        previous = self.rows.get(server_id, dict())
+        current = OrderedDict()
+        changed = []
+        for metric in metrics:
+            if metric.backend in previous and previous[metric.backend][0] == metric:
+                current[metric.backend] = previous[metric.backend]
+            else:
+                current[metric.backend] = (metric, encode_metric(metric))
+                changed.append(metric.backend)
+        removed = [backend for backend in previous.keys() if backend not in current]
+        self.rows[server_id] = current
+        self.push_update(server_id, current, changed, removed)
+
+    def push_update(self, server_id, current, changed, removed):
+        if not changed and not removed:
+            return
+
+        # frames are encoded once per distinct backend filter, and shared between subscribers
+        frames = dict()
+        for subscription in self.subscriptions:
+            if not subscription.wants_server(server_id):
+                continue
+            key = subscription.filter_key
+            if key not in frames:
+                rows = [current[backend][1] for backend in changed if subscription.wants_backend(backend)]
+                gone = [backend for backend in removed if subscription.wants_backend(backend)]
+                frames[key] = encode_frame("update", rows, server_id=server_id, removed=gone) \
+                    if rows or gone else None
+            if frames[key] is not None:
+                subscription.push(frames[key])
+
+    def snapshot_frame(self, subscription):
+        rows = []
+        for server_id, server_rows in self.rows.items():
+            if not subscription.wants_server(server_id):
+                continue
+            rows.extend(encoded for backend, (_, encoded) in server_rows.items() if subscription.wants_backend(backend))
+        return encode_frame("snapshot", rows)
@@ -4,6 +4,10 @@ import yaml
 import traceback
 from copy import deepcopy
 from haproxysessionmon.errors import *
+from haproxysessionmon.topk import TOPK_METRICS
+from haproxysessionmon.discovery import DISCOVERY_QUERY_TYPES
+from haproxysessionmon.alerts import compile_condition
+from haproxysessionmon.backends.summary import SUMMARISED_FIELDS, quantile_field_name
 
 import logging
 logger = logging.getLogger(__name__)
@@ -14,7 +18,12 @@ __all__ = [
     "CONFIG_DEFAULTS",
     "CONFIG_BACKEND_TYPE_GELF",
     "CONFIG_BACKEND_TYPE_PRTG",
-    "CONFIG_BACKEND_TYPE_LOGFILE"
+    "CONFIG_BACKEND_TYPE_LOGFILE",
+    "CONFIG_BACKEND_TYPE_AGGREGATE",
+    "CONFIG_BACKEND_TYPE_SUMMARY",
+    "CONFIG_BACKEND_TYPE_STREAM",
+    "CONFIG_BACKEND_TYPE_SHM",
+    "CONFIG_FORWARDING_BACKEND_TYPES"
 ]
 
 CONFIG_DEFAULTS = {
@@ -24,7 +33,44 @@ CONFIG_DEFAULTS = {
         "console": True
     },
     "servers": {
-        "update-interval": 10.0
+        "update-interval": 10.0,
+        "include-servers": False
+    },
+    "top-k": {
+        "metrics": ["sessions"]
+    },
+    "discover": {
+        "type": "A",
+        "path": "/haproxy?stats;csv",
+        "scheme": "http",
+        "min-ttl": 5.0,
+        "max-ttl": 300.0
+    },
+    "aggregate": {
+        "update-interval": 10.0,
+        # multiple of the update interval after which non-reporting servers are expired
+        "expiry-intervals": 3
+    },
+    "shm": {
+        "capacity": 4096,
+        "expiry": 60.0
+    },
+    "stream": {
+        "host": "0.0.0.0",
+        "max-pending": 100,
+        "expiry": 60.0
+    },
+    "alerts": {
+        "backend": "*",
+        "server": "*",
+        "for": 1
+    },
+    "summary": {
+        "window": 60.0,
+        "quantiles": [0.5, 0.95, 0.99],
+        "relative-accuracy": 0.01,
+        "max-bins": 2048,
+        "merge-servers": False
     }
 }
 
@@ -33,19 +79,43 @@ CONFIG_LOGGING_LEVELS = {"DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"}
 CONFIG_BACKEND_TYPE_GELF = "gelf"
 CONFIG_BACKEND_TYPE_PRTG = "prtg"
 CONFIG_BACKEND_TYPE_LOGFILE = "logfile"
+CONFIG_BACKEND_TYPE_AGGREGATE = "aggregate"
+CONFIG_BACKEND_TYPE_SUMMARY = "summary"
+CONFIG_BACKEND_TYPE_STREAM = "stream"
+CONFIG_BACKEND_TYPE_SHM = "shm"
 CONFIG_BACKEND_TYPES = {
     CONFIG_BACKEND_TYPE_GELF,
     CONFIG_BACKEND_TYPE_PRTG,
-    CONFIG_BACKEND_TYPE_LOGFILE
+    CONFIG_BACKEND_TYPE_LOGFILE,
+    CONFIG_BACKEND_TYPE_AGGREGATE,
+    CONFIG_BACKEND_TYPE_SUMMARY,
+    CONFIG_BACKEND_TYPE_STREAM,
+    CONFIG_BACKEND_TYPE_SHM
+}
+
+# backend types which pass their own metrics on to other backends
+CONFIG_FORWARDING_BACKEND_TYPES = {
+    CONFIG_BACKEND_TYPE_AGGREGATE,
+    CONFIG_BACKEND_TYPE_SUMMARY
+}
+
+# backend types which treat each batch of metrics as the complete snapshot of the servers in it
+CONFIG_SNAPSHOT_BACKEND_TYPES = CONFIG_FORWARDING_BACKEND_TYPES | {
+    CONFIG_BACKEND_TYPE_STREAM,
+    CONFIG_BACKEND_TYPE_SHM
 }
 
 CONFIG_BACKEND_REQUIRED_FIELDS = {
     CONFIG_BACKEND_TYPE_GELF: {"host", "port", "facility"},
     CONFIG_BACKEND_TYPE_PRTG: {"base-url", "gid", "key"},
-    CONFIG_BACKEND_TYPE_LOGFILE: {"path"}
+    CONFIG_BACKEND_TYPE_LOGFILE: {"path"},
+    CONFIG_BACKEND_TYPE_AGGREGATE: {"backends"},
+    CONFIG_BACKEND_TYPE_SUMMARY: {"backends"},
+    CONFIG_BACKEND_TYPE_STREAM: {"port"},
+    CONFIG_BACKEND_TYPE_SHM: {"path"}
 }
 
-CONFIG_SERVER_REQUIRED_FIELDS = {"endpoint", "backends"}
+CONFIG_SERVER_REQUIRED_FIELDS = {"backends"}
 
 
 def validate_logging_config(config):
@@ -83,10 +153,126 @@ def validate_logfile_backend_config(backend_name, backend_config):
     return backend_config
 
 
+def validate_stream_backend_config(backend_name, backend_config):
+    for field_name in ['port', 'max-pending']:
+        if field_name in backend_config:
+            try:
+                backend_config[field_name] = int(backend_config[field_name])
+            except ValueError:
+                raise ConfigError("Field \"{}\" for backend \"{}\" must be an integer value".format(
+                    field_name,
+                    backend_name
+                ))
+    if 'expiry' in backend_config:
+        try:
+            backend_config['expiry'] = float(backend_config['expiry'])
+        except ValueError:
+            raise ConfigError("Field \"expiry\" for backend \"{}\" must be a numeric value".format(backend_name))
+    for field_name, default in CONFIG_DEFAULTS['stream'].items():
+        if field_name not in backend_config:
+            backend_config[field_name] = default
+    return backend_config
+
+
+def validate_shm_backend_config(backend_name, backend_config):
+    try:
+        backend_config['capacity'] = int(backend_config.get('capacity', CONFIG_DEFAULTS['shm']['capacity']))
+    except ValueError:
+        raise ConfigError("Field \"capacity\" for backend \"{}\" must be an integer value".format(backend_name))
+    if backend_config['capacity'] < 1:
+        raise ConfigError("Field \"capacity\" for backend \"{}\" must be at least 1".format(backend_name))
+    try:
+        backend_config['expiry'] = float(backend_config.get('expiry', CONFIG_DEFAULTS['shm']['expiry']))
+    except ValueError:
+        raise ConfigError("Field \"expiry\" for backend \"{}\" must be a numeric value".format(backend_name))
+    return backend_config
+
+
+def validate_forwarding_backend_config(backend_name, backend_config, numeric_fields):
+    if not isinstance(backend_config['backends'], list) or len(backend_config['backends']) < 1:
+        raise ConfigError("One or more backends are required for {} backend \"{}\"".format(
+            backend_config['type'],
+            backend_name
+        ))
+
+    for field_name in numeric_fields:
+        if field_name in backend_config:
+            try:
+                backend_config[field_name] = float(backend_config[field_name])
+            except ValueError:
+                raise ConfigError("Field \"{}\" for backend \"{}\" must be a numeric value".format(
+                    field_name,
+                    backend_name
+                ))
+
+    if 'id' not in backend_config:
+        backend_config['id'] = backend_name
+    return backend_config
+
+
+def validate_aggregate_backend_config(backend_name, backend_config):
+    backend_config = validate_forwarding_backend_config(backend_name, backend_config, ['update-interval', 'expiry'])
+    if 'update-interval' not in backend_config:
+        backend_config['update-interval'] = CONFIG_DEFAULTS['aggregate']['update-interval']
+    if 'expiry' not in backend_config:
+        backend_config['expiry'] = backend_config['update-interval'] * CONFIG_DEFAULTS['aggregate']['expiry-intervals']
+    return backend_config
+
+
+def validate_summary_backend_config(backend_name, backend_config):
+    backend_config = validate_forwarding_backend_config(
+        backend_name,
+        backend_config,
+        ['window', 'relative-accuracy', 'max-bins']
+    )
+    for field_name, default in CONFIG_DEFAULTS['summary'].items():
+        if field_name not in backend_config:
+            backend_config[field_name] = deepcopy(default)
+
+    try:
+        backend_config['max-bins'] = int(backend_config['max-bins'])
+    except ValueError:
+        raise ConfigError("Field \"max-bins\" for backend \"{}\" must be an integer value".format(backend_name))
+    if backend_config['max-bins'] < 1:
+        raise ConfigError("Field \"max-bins\" for backend \"{}\" must be at least 1".format(backend_name))
+    backend_config['merge-servers'] = bool(backend_config['merge-servers'])
+    if not 0.0 < backend_config['relative-accuracy'] < 1.0:
+        raise ConfigError("Field \"relative-accuracy\" for backend \"{}\" must be between 0 and 1".format(
+            backend_name
+        ))
+
+    if not isinstance(backend_config['quantiles'], list) or len(backend_config['quantiles']) < 1:
+        raise ConfigError("Field \"quantiles\" for backend \"{}\" must be a list of quantiles".format(backend_name))
+    try:
+        backend_config['quantiles'] = [float(q) for q in backend_config['quantiles']]
+    except ValueError:
+        raise ConfigError("Field \"quantiles\" for backend \"{}\" must only contain numeric values".format(
+            backend_name
+        ))
+    for q in backend_config['quantiles']:
+        if not 0.0 <= q <= 1.0:
+            raise ConfigError("Quantiles for backend \"{}\" must be between 0 and 1".format(backend_name))
+
+    # each quantile is reported in its own field, so the field names must be distinct, valid identifiers
+    field_names = [quantile_field_name(SUMMARISED_FIELDS[0], q) for q in backend_config['quantiles']]
+    for q, field_name in zip(backend_config['quantiles'], field_names):
+        if not field_name.isidentifier():
+            raise ConfigError("Quantile {} for backend \"{}\" is too small to be reported".format(q, backend_name))
+    if len(set(field_names)) != len(field_names):
+        raise ConfigError("Field \"quantiles\" for backend \"{}\" must not contain duplicate quantiles".format(
+            backend_name
+        ))
+    return backend_config
+
+
 CONFIG_BACKEND_VALIDATORS = {
     CONFIG_BACKEND_TYPE_GELF: validate_gelf_backend_config,
     CONFIG_BACKEND_TYPE_PRTG: validate_prtg_backend_config,
-    CONFIG_BACKEND_TYPE_LOGFILE: validate_logfile_backend_config
+    CONFIG_BACKEND_TYPE_LOGFILE: validate_logfile_backend_config,
+    CONFIG_BACKEND_TYPE_AGGREGATE: validate_aggregate_backend_config,
+    CONFIG_BACKEND_TYPE_SUMMARY: validate_summary_backend_config,
+    CONFIG_BACKEND_TYPE_STREAM: validate_stream_backend_config,
+    CONFIG_BACKEND_TYPE_SHM: validate_shm_backend_config
 }
 
 
@@ -117,9 +303,108 @@ def validate_backends_config(config):
 
         config['backends'][backend] = validate_backend_config(backend, backend_config)
 
+    # backends which forward their metrics may only forward them to plain storage backends
+    for backend, backend_config in config['backends'].items():
+        if backend_config['type'] not in CONFIG_FORWARDING_BACKEND_TYPES:
+            continue
+        for target in backend_config['backends']:
+            if target not in config['backends']:
+                raise ConfigError("Backend \"{}\" refers to unrecognised backend \"{}\"".format(backend, target))
+            if config['backends'][target]['type'] in CONFIG_FORWARDING_BACKEND_TYPES:
+                raise ConfigError("Backend \"{}\" cannot forward metrics to backend \"{}\" of type \"{}\"".format(
+                    backend,
+                    target,
+                    config['backends'][target]['type']
+                ))
+
     return config
 
 
+def validate_top_k_config(server_name, top_k_config):
+    if not isinstance(top_k_config, dict) or 'size' not in top_k_config:
+        raise ConfigError("Field \"top-k\" for server \"{}\" must contain a \"size\"".format(server_name))
+
+    try:
+        top_k_config['size'] = int(top_k_config['size'])
+    except ValueError:
+        raise ConfigError("Field \"top-k.size\" for server \"{}\" must be an integer value".format(server_name))
+    if top_k_config['size'] < 1:
+        raise ConfigError("Field \"top-k.size\" for server \"{}\" must be at least 1".format(server_name))
+
+    if 'metrics' not in top_k_config:
+        top_k_config['metrics'] = deepcopy(CONFIG_DEFAULTS['top-k']['metrics'])
+    if not isinstance(top_k_config['metrics'], list) or len(top_k_config['metrics']) < 1:
+        raise ConfigError("Field \"top-k.metrics\" for server \"{}\" must be a list of metrics".format(server_name))
+    for metric in top_k_config['metrics']:
+        if metric not in TOPK_METRICS:
+            raise ConfigError("Unrecognised top-k metric for server \"{}\": {}".format(server_name, metric))
+    return top_k_config
+
+
+def validate_discover_config(server_name, discover_config):
+    if not isinstance(discover_config, dict) or 'name' not in discover_config:
+        raise ConfigError("Field \"discover\" for server \"{}\" must contain a \"name\"".format(server_name))
+
+    for field_name, default in CONFIG_DEFAULTS['discover'].items():
+        if field_name not in discover_config:
+            discover_config[field_name] = default
+
+    if discover_config['type'] not in DISCOVERY_QUERY_TYPES:
+        raise ConfigError("Unrecognised DNS record type for server \"{}\": {}".format(
+            server_name,
+            discover_config['type']
+        ))
+
+    if 'port' in discover_config:
+        try:
+            discover_config['port'] = int(discover_config['port'])
+        except ValueError:
+            raise ConfigError("Invalid port specified for server \"{}\"".format(server_name))
+    elif discover_config['type'] != "SRV":
+        raise ConfigError("Field \"discover.port\" is required for {} records in server \"{}\"".format(
+            discover_config['type'],
+            server_name
+        ))
+    else:
+        discover_config['port'] = None
+
+    for field_name in ['min-ttl', 'max-ttl']:
+        try:
+            discover_config[field_name] = float(discover_config[field_name])
+        except ValueError:
+            raise ConfigError("Field \"discover.{}\" for server \"{}\" must be a numeric value".format(
+                field_name,
+                server_name
+            ))
+    if discover_config['min-ttl'] > discover_config['max-ttl']:
+        raise ConfigError("Field \"discover.min-ttl\" for server \"{}\" must not exceed \"discover.max-ttl\"".format(
+            server_name
+        ))
+    return discover_config
+
+
+def validate_server_endpoints_config(server_name, server_config):
+    # a server either has a single endpoint, one endpoint per HAProxy process, or discovers its endpoints
+    if len({'endpoint', 'endpoints', 'discover'} & set(server_config.keys())) != 1:
+        raise ConfigError(
+            "Exactly one of \"endpoint\", \"endpoints\" or \"discover\" is required in server config \"{}\"".format(
+                server_name
+            )
+        )
+
+    if 'discover' in server_config:
+        server_config['discover'] = validate_discover_config(server_name, server_config['discover'])
+        return []
+
+    endpoints = [server_config['endpoint']] if 'endpoint' in server_config else server_config['endpoints']
+    if not isinstance(endpoints, list) or len(endpoints) < 1:
+        raise ConfigError("Field \"endpoints\" for server \"{}\" must be a list of endpoints".format(server_name))
+    for endpoint in endpoints:
+        if not isinstance(endpoint, str) or not endpoint:
+            raise ConfigError("Invalid endpoint for server \"{}\": {}".format(server_name, endpoint))
+    return endpoints
+
+
 def validate_servers_config(config):
     server_ids = config['servers'].keys()
     for server in server_ids:
@@ -136,6 +421,8 @@ def validate_servers_config(config):
                     server
                 ))
 
+        server_config['endpoints'] = validate_server_endpoints_config(server, server_config)
+
         if 'update-interval' in server_config:
             try:
                 server_config['update-interval'] = float(server_config['update-interval'])
@@ -146,6 +433,13 @@ def validate_servers_config(config):
         else:
             server_config['update-interval'] = CONFIG_DEFAULTS['servers']['update-interval']
 
+        server_config['include-servers'] = bool(
+            server_config.get('include-servers', CONFIG_DEFAULTS['servers']['include-servers'])
+        )
+
+        if 'top-k' in server_config:
+            server_config['top-k'] = validate_top_k_config(server, server_config['top-k'])
+
         # if there are auth credentials for the server
         if 'username' in server_config:
             if 'password' not in server_config:
@@ -167,6 +461,54 @@ def validate_servers_config(config):
     return config
 
 
+def validate_alerts_config(config):
+    if 'alerts' not in config or config['alerts'] is None:
+        config['alerts'] = dict()
+        return config
+    if not isinstance(config['alerts'], dict):
+        raise ConfigError("Invalid configuration syntax for alerts")
+
+    for alert, alert_config in config['alerts'].items():
+        if not isinstance(alert_config, dict) or 'condition' not in alert_config:
+            raise ConfigError("Missing required field \"condition\" in alert \"{}\" configuration".format(alert))
+
+        for field_name, default in CONFIG_DEFAULTS['alerts'].items():
+            if field_name not in alert_config:
+                alert_config[field_name] = default
+        if 'clear-for' not in alert_config:
+            alert_config['clear-for'] = alert_config['for']
+
+        for field_name in ['condition', 'clear-condition']:
+            if field_name in alert_config:
+                try:
+                    compile_condition(str(alert_config[field_name]))
+                except ValueError as e:
+                    raise ConfigError("Invalid \"{}\" in alert \"{}\": {}".format(field_name, alert, e))
+
+        for field_name in ['for', 'clear-for']:
+            try:
+                alert_config[field_name] = int(alert_config[field_name])
+            except ValueError:
+                raise ConfigError("Field \"{}\" for alert \"{}\" must be an integer value".format(field_name, alert))
+            if alert_config[field_name] < 1:
+                raise ConfigError("Field \"{}\" for alert \"{}\" must be at least 1".format(field_name, alert))
+
+        if 'backends' not in alert_config or not isinstance(alert_config['backends'], list):
+            raise ConfigError("One or more backends are required for alert \"{}\" configuration".format(alert))
+        for backend in alert_config['backends']:
+            if backend not in config['backends']:
+                raise ConfigError("Alert \"{}\" refers to unrecognised backend \"{}\"".format(alert, backend))
+            # alert events are not snapshots, and would replace the rows of the servers they refer to
+            if config['backends'][backend]['type'] in CONFIG_SNAPSHOT_BACKEND_TYPES:
+                raise ConfigError("Alert \"{}\" cannot send events to backend \"{}\" of type \"{}\"".format(
+                    alert,
+                    backend,
+                    config['backends'][backend]['type']
+                ))
+
+    return config
+
+
 def load_haproxysessionmon_config(s):
     """Loads the HAProxy Session Monitor configuration from the given string, filling in defaults
     where necessary.
@@ -193,7 +535,8 @@ def load_haproxysessionmon_config(s):
 
     config = validate_logging_config(config)
     config = validate_backends_config(config)
-    return validate_servers_config(config)
+    config = validate_servers_config(config)
+    return validate_alerts_config(config)
 
 
 def load_haproxysessionmon_config_from_file(filename):
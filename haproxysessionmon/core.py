@@ -2,16 +2,24 @@
 
 import asyncio
 import aiohttp
+import aiodns
 import signal
 import functools
 import sys
 import os
+import time
 
 from haproxysessionmon import __version__ as VERSION
 from haproxysessionmon.config import *
 from haproxysessionmon.errors import *
 from haproxysessionmon.haproxy import *
+from haproxysessionmon.archive import *
+from haproxysessionmon.discovery import *
+from haproxysessionmon.alerts import *
+from haproxysessionmon.profiling import *
+from haproxysessionmon.topk import *
 from haproxysessionmon.backends import *
+from haproxysessionmon.backends.base import ForwardingBackend
 
 from colorlog import ColoredFormatter
 import logging
@@ -25,6 +33,102 @@ async def run_monitors(monitors, loop):
         )
 
 
+async def replay_archive(archive, monitors, speed=1.0, clock=None):
+    """Replays the raw stats responses from the given archive through the monitors' parsing and backends.
+
+    Args:
+        archive: A StatsArchiveReader from which to read the recorded responses.
+        monitors: A dictionary of monitors, keyed by server ID, through which to replay the responses.
+        speed: The speed at which to replay the archive, relative to the speed at which it was recorded.
+            A speed of 0 replays the archive as fast as possible.
+        clock: An optional ReplayClock, driving the monitors' time-based backends, to advance to each
+            record's timestamp as it is replayed.
+    """
+    replayed = 0
+    skipped = set()
+    # server ID -> monitor through which that server's responses are replayed
+    replay_monitors = dict()
+    previous_timestamp = None
+    for server_id, timestamp, csv_responses in group_archive_records(archive):
+        if server_id not in replay_monitors:
+            monitor = find_replay_monitor(monitors, server_id)
+            if monitor is not None:
+                replay_monitors[server_id] = monitor
+        if server_id not in replay_monitors:
+            if server_id not in skipped:
+                logger.warning("No configured server for recorded server ID {}, skipping".format(server_id))
+                skipped.add(server_id)
+            continue
+
+        if speed > 0 and previous_timestamp is not None and timestamp > previous_timestamp:
+            await asyncio.sleep((timestamp - previous_timestamp) / speed)
+        previous_timestamp = timestamp
+        if clock is not None:
+            clock.now = timestamp
+
+        monitor = replay_monitors[server_id]
+        started = time.time()
+        parse_started = time.monotonic()
+        stats = monitor.process_csv_stats(*csv_responses)
+        store_started = time.monotonic()
+        await monitor.track_stats(stats)
+        if monitor.profiler is not None:
+            finished = time.monotonic()
+            monitor.profiler.record_tick(
+                monitor.id,
+                finished - parse_started,
+                0.0,
+                store_started - parse_started,
+                finished - store_started,
+                started
+            )
+        replayed += 1
+
+    # emit whatever the forwarding backends have accumulated since their last interval
+    for backend in iter_forwarding_backends(replay_monitors.values()):
+        await backend.flush()
+
+    logger.info("Replayed {} recorded poll(s) from {}".format(replayed, archive.path))
+    return replayed
+
+
+def find_replay_monitor(monitors, server_id):
+    """Finds the monitor through which to replay the recorded responses of the given server ID. Discovered
+    servers' IDs (of the form "id/host:port") are mapped back to the group which discovered them."""
+    if server_id in monitors:
+        return monitors[server_id]
+    group = monitors.get(server_id.split("/", 1)[0])
+    if isinstance(group, DiscoveredServerMonitor):
+        return group.replay_monitor(server_id)
+    return None
+
+
+def iter_forwarding_backends(monitors):
+    """Yields each of the forwarding backends used by the given monitors once."""
+    seen = set()
+    for monitor in monitors:
+        for backend in monitor.backends:
+            if isinstance(backend, ForwardingBackend) and id(backend) not in seen:
+                seen.add(id(backend))
+                yield backend
+
+
+def group_archive_records(archive):
+    """Groups consecutive records in the given archive from the same poll of the same server (i.e. the
+    responses from each of a server's HAProxy processes), yielding (server ID, timestamp, list of CSV
+    responses) tuples."""
+    group = None
+    for record in archive:
+        if group is not None and group[0] == record.server_id and group[1] == record.timestamp:
+            group[2].append(record.csv_data)
+            continue
+        if group is not None:
+            yield group
+        group = (record.server_id, record.timestamp, [record.csv_data])
+    if group is not None:
+        yield group
+
+
 def configure_logging(to_file=None, to_console=True, level="DEBUG"):
     handlers = []
     if to_console:
@@ -53,17 +157,24 @@ def configure_signal_handling(loop):
         )
 
 
+def configure_profiler_signal_handling(loop, profiler):
+    loop.add_signal_handler(signal.SIGUSR1, profiler.toggle)
+
+
 def signal_handler(loop, signame):
     logger.debug("Got signal {}".format(signame))
     loop.stop()
 
 
-def create_monitors(config, loop):
-    """Creates the HAProxy server monitors from the given configuration object."""
+def create_backends(config, loop, clock=time.monotonic):
+    """Creates the storage backends from the given configuration object. Time-based backends read the
+    current time from the given clock."""
     backends = dict()
-    monitors = dict()
 
+    # plain storage backends first, so that forwarding backends can refer to them
     for backend_id, backend_config in config['backends'].items():
+        if backend_config['type'] in CONFIG_FORWARDING_BACKEND_TYPES:
+            continue
         logger.debug("Creating backend {} ({})".format(backend_id, backend_config['type']))
         if backend_config['type'] == CONFIG_BACKEND_TYPE_GELF:
             backends[backend_id] = GraylogBackend(
@@ -75,19 +186,126 @@ def create_monitors(config, loop):
             backends[backend_id] = LogfileBackend(
                 backend_config['filename']
             )
+        elif backend_config['type'] == CONFIG_BACKEND_TYPE_STREAM:
+            backends[backend_id] = StreamingBackend(
+                backend_config['host'],
+                backend_config['port'],
+                loop,
+                max_pending=backend_config['max-pending'],
+                expiry=backend_config['expiry']
+            )
+        elif backend_config['type'] == CONFIG_BACKEND_TYPE_SHM:
+            backends[backend_id] = SharedMemoryBackend(
+                backend_config['path'],
+                capacity=backend_config['capacity'],
+                expiry=backend_config['expiry']
+            )
         else:
             logger.warning("Backend currently not supported, skipping: {}".format(backend_config['type']))
 
+    for backend_id, backend_config in config['backends'].items():
+        if backend_config['type'] not in CONFIG_FORWARDING_BACKEND_TYPES:
+            continue
+        logger.debug("Creating backend {} ({})".format(backend_id, backend_config['type']))
+        targets = [backends[b] for b in backend_config['backends'] if b in backends]
+        if backend_config['type'] == CONFIG_BACKEND_TYPE_AGGREGATE:
+            backends[backend_id] = FleetAggregateBackend(
+                backend_config['id'],
+                targets,
+                update_interval=backend_config['update-interval'],
+                expiry=backend_config['expiry'],
+                clock=clock
+            )
+        elif backend_config['type'] == CONFIG_BACKEND_TYPE_SUMMARY:
+            backends[backend_id] = SummaryBackend(
+                backend_config['id'],
+                targets,
+                window=backend_config['window'],
+                quantiles=backend_config['quantiles'],
+                relative_accuracy=backend_config['relative-accuracy'],
+                max_bins=backend_config['max-bins'],
+                merge_servers=backend_config['merge-servers'],
+                clock=clock
+            )
+
+    return backends
+
+
+def create_alert_engine(config, backends):
+    """Creates the alerting engine from the given configuration object, if any alerts are configured."""
+    if not config['alerts']:
+        return None
+
+    rules = []
+    for alert, alert_config in config['alerts'].items():
+        rules.append(AlertRule(
+            alert,
+            str(alert_config['condition']),
+            [backends[b] for b in alert_config['backends'] if b in backends],
+            backend_pattern=alert_config['backend'],
+            server_pattern=alert_config['server'],
+            for_ticks=alert_config['for'],
+            clear_condition=str(alert_config['clear-condition']) if 'clear-condition' in alert_config else None,
+            clear_ticks=alert_config['clear-for']
+        ))
+    # servers are forgotten once they have missed the same number of updates as for aggregate backends
+    expiry = max(server_config['update-interval'] for server_config in config['servers'].values()) * \
+        CONFIG_DEFAULTS['aggregate']['expiry-intervals']
+    logger.debug("Created alerting engine with {} rule(s)".format(len(rules)))
+    return AlertEngine(rules, expiry=expiry)
+
+
+def create_monitors(config, loop, recorder=None, profiler=None, clock=time.monotonic):
+    """Creates the HAProxy server monitors from the given configuration object."""
+    backends = create_backends(config, loop, clock=clock)
+    alert_engine = create_alert_engine(config, backends)
+    monitors = dict()
+
+    dns_resolver = None
+
     for monitor_id, server_config in config['servers'].items():
-        logger.debug("Creating monitor for server at {}".format(server_config['endpoint']))
-        monitors[monitor_id] = HAProxyServerMonitor(
-            monitor_id,
-            server_config['endpoint'],
-            backends=[backends[b] for b in server_config['backends']],
+        create_monitor = functools.partial(
+            HAProxyServerMonitor,
+            backends=[backends[b] for b in server_config['backends'] if b in backends] +
+            ([alert_engine] if alert_engine is not None else []),
             auth_creds=(server_config['username'], server_config['password']) if 'username' in server_config else None,
-            update_interval=server_config['update-interval']
+            update_interval=server_config['update-interval'],
+            include_servers=server_config['include-servers'],
+            top_k=TopKSelector(
+                server_config['top-k']['size'],
+                metrics=server_config['top-k']['metrics']
+            ) if 'top-k' in server_config else None,
+            recorder=recorder,
+            profiler=profiler
         )
 
+        if 'discover' in server_config:
+            discover_config = server_config['discover']
+            logger.debug("Creating monitor for servers discovered through {} record {}".format(
+                discover_config['type'],
+                discover_config['name']
+            ))
+            # all discovering monitors share a single resolver
+            if dns_resolver is None:
+                dns_resolver = aiodns.DNSResolver(loop=loop)
+            monitors[monitor_id] = DiscoveredServerMonitor(
+                monitor_id,
+                DNSResolverCache(
+                    resolver=dns_resolver,
+                    min_ttl=discover_config['min-ttl'],
+                    max_ttl=discover_config['max-ttl']
+                ),
+                discover_config['name'],
+                create_monitor,
+                query_type=discover_config['type'],
+                port=discover_config['port'],
+                path=discover_config['path'],
+                scheme=discover_config['scheme']
+            )
+        else:
+            logger.debug("Creating monitor for server at {}".format(", ".join(server_config['endpoints'])))
+            monitors[monitor_id] = create_monitor(monitor_id, server_config['endpoints'])
+
     return monitors
 
 
@@ -105,6 +323,35 @@ def main():
         action="store_true",
         help="Display the version of the application and exit."
     )
+    parser.add_argument(
+        "--record",
+        metavar="ARCHIVE",
+        help="Record each raw stats response to the given archive file."
+    )
+    parser.add_argument(
+        "--replay",
+        metavar="ARCHIVE",
+        help="Replay the raw stats responses from the given archive file through the configured backends, "
+             "instead of polling the configured servers."
+    )
+    parser.add_argument(
+        "--replay-speed",
+        type=float,
+        default=1.0,
+        help="The speed at which to replay an archive, relative to its original speed (0 to replay as fast "
+             "as possible). Default: 1.0"
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="DIR",
+        help="Profile the event loop and monitors, writing the results to the given directory. Send SIGUSR1 "
+             "to toggle profiling at runtime (results are written each time profiling stops)."
+    )
+    parser.add_argument(
+        "--profile-paused",
+        action="store_true",
+        help="Only start profiling once SIGUSR1 is received."
+    )
     args = parser.parse_args()
 
     if args.version:
@@ -131,12 +378,43 @@ def main():
     logger.debug("Loaded configuration from file: {}".format(config_file))
     loop = asyncio.get_event_loop()
     configure_signal_handling(loop)
-    monitors = create_monitors(config, loop)
+    recorder = StatsArchiveWriter(args.record) if args.record else None
+    profiler = LoopProfiler(loop, args.profile) if args.profile else None
+    if profiler is not None:
+        configure_profiler_signal_handling(loop, profiler)
+        if not args.profile_paused:
+            profiler.start()
+    # when replaying, time-based backends follow the recorded timestamps
+    replay_clock = ReplayClock() if args.replay else None
+    monitors = create_monitors(
+        config,
+        loop,
+        recorder=recorder,
+        profiler=profiler,
+        clock=replay_clock if replay_clock is not None else time.monotonic
+    )
 
     try:
-        logger.info("Starting up {} monitor(s)".format(len(monitors)))
-        loop.run_until_complete(run_monitors(monitors, loop))
+        if args.replay:
+            logger.info("Replaying archive {}".format(args.replay))
+            archive = StatsArchiveReader(args.replay)
+            try:
+                loop.run_until_complete(replay_archive(
+                    archive,
+                    monitors,
+                    speed=args.replay_speed,
+                    clock=replay_clock
+                ))
+            finally:
+                archive.close()
+        else:
+            logger.info("Starting up {} monitor(s)".format(len(monitors)))
+            loop.run_until_complete(run_monitors(monitors, loop))
     finally:
+        if recorder is not None:
+            recorder.close()
+        if profiler is not None:
+            profiler.stop()
         logger.info("Shutting down event loop")
         loop.run_until_complete(loop.shutdown_asyncgens())
         loop.close()
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+
+import time
+import asyncio
+import functools
+import aiodns
+
+import logging
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    "DNSResolverCache",
+    "DiscoveredServerMonitor",
+    "DISCOVERY_QUERY_TYPES"
+]
+
+DISCOVERY_QUERY_TYPES = {"A", "AAAA", "SRV"}
+
+
+class DNSResolverCache(object):
+    """Resolves DNS A, AAAA and SRV records asynchronously, caching the results for as long as their TTLs
+    allow."""
+
+    def __init__(self, resolver=None, loop=None, min_ttl=5.0, max_ttl=300.0, clock=time.monotonic):
+        """Constructor.
+
+        Args:
+            resolver: The resolver to use for DNS queries (an aiodns.DNSResolver will be created if not
+                supplied).
+            loop: The event loop to use when creating a resolver.
+            min_ttl: The minimum time, in seconds, for which to cache results (and to wait before retrying
+                failed queries).
+            max_ttl: The maximum time, in seconds, for which to cache results.
+            clock: A callable returning the current time, in seconds.
+        """
+        self.resolver = resolver if resolver is not None else aiodns.DNSResolver(loop=loop)
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self.clock = clock
+        # (name, query type) -> (expiry time, list of (host, port) tuples)
+        self.cache = dict()
+
+    async def resolve(self, name, query_type):
+        """Resolves the given name.
+
+        Returns:
+            A 2-tuple containing a list of (host, port) tuples (where the port is None for A and AAAA
+            records), and the number of seconds for which this result remains valid.
+        """
+        now = self.clock()
+        key = (name, query_type)
+        if key in self.cache and self.cache[key][0] > now:
+            return self.cache[key][1], self.cache[key][0] - now
+
+        try:
+            results = await self.resolver.query(name, query_type)
+        except aiodns.error.DNSError as e:
+            # keep using the previous addresses (if any) until the name resolves again
+            addresses = self.cache[key][1] if key in self.cache else []
+            logger.error("Failed to resolve {} record for {}: {}".format(query_type, name, e))
+            self.cache[key] = (now + self.min_ttl, addresses)
+            return addresses, self.min_ttl
+
+        if query_type == "SRV":
+            addresses = sorted((result.host, result.port) for result in results)
+        else:
+            addresses = sorted((result.host, None) for result in results)
+        ttl = min([result.ttl for result in results] or [self.min_ttl])
+        ttl = float(max(self.min_ttl, min(self.max_ttl, ttl)))
+        self.cache[key] = (now + ttl, addresses)
+        return addresses, ttl
+
+
+class DiscoveredServerMonitor(object):
+    """Monitors a dynamic group of HAProxy servers, whose addresses are discovered through DNS. A monitor is
+    created for each address as it appears, and retired as it disappears."""
+
+    def __init__(self, id, resolver, name, create_monitor, query_type="A", port=None, path="/haproxy?stats;csv",
+                 scheme="http", restart_delay=5.0):
+        """Constructor.
+
+        Args:
+            id: A short, descriptive name/title for this group of HAProxy instances. The ID of each
+                discovered server's monitor is of the form "id/host:port".
+            resolver: The DNSResolverCache to use for discovering the servers' addresses.
+            name: The DNS name to resolve.
+            create_monitor: A callable accepting a monitor ID and stats endpoint URL, which creates the
+                HAProxyServerMonitor for a discovered server.
+            query_type: The type of DNS record to query ("A", "AAAA" or "SRV").
+            port: The port of the stats endpoint (required for A and AAAA records).
+            path: The path of the stats endpoint.
+            scheme: The URL scheme of the stats endpoint.
+            restart_delay: The time, in seconds, to wait before restarting the monitor of a discovered server
+                after it fails.
+        """
+        self.id = id
+        self.resolver = resolver
+        self.name = name
+        self.create_monitor = create_monitor
+        self.query_type = query_type
+        self.port = port
+        self.path = path
+        self.scheme = scheme
+        self.restart_delay = restart_delay
+        self.must_stop = False
+        # endpoint -> (monitor, polling task)
+        self.monitors = dict()
+        # monitor ID -> monitor, for replaying recorded responses
+        self.replay_monitors = dict()
+
+    def endpoint_for(self, host, port):
+        if ":" in host:
+            # IPv6 address
+            host = "[{}]".format(host)
+        return "{}://{}:{}{}".format(self.scheme, host, port if port is not None else self.port, self.path)
+
+    async def poll_for_stats(self, client):
+        try:
+            while not self.must_stop:
+                await asyncio.sleep(await self.refresh(client))
+        finally:
+            self.retire(list(self.monitors.keys()))
+
+    async def refresh(self, client):
+        """Brings the set of monitors in line with the currently resolved addresses, returning the number of
+        seconds until the addresses need to be resolved again."""
+        addresses, ttl = await self.resolver.resolve(self.name, self.query_type)
+        endpoints = dict()
+        for host, port in addresses:
+            endpoints[self.endpoint_for(host, port)] = "{}/{}:{}".format(
+                self.id,
+                host,
+                port if port is not None else self.port
+            )
+
+        for endpoint, monitor_id in endpoints.items():
+            if endpoint not in self.monitors:
+                logger.info("Discovered HAProxy server {} at {}".format(monitor_id, endpoint))
+                self.start_monitor(endpoint, monitor_id, client)
+
+        self.retire([endpoint for endpoint in self.monitors.keys() if endpoint not in endpoints])
+        return ttl
+
+    def start_monitor(self, endpoint, monitor_id, client, delay=0.0):
+        monitor = self.create_monitor(monitor_id, endpoint)
+        task = asyncio.ensure_future(self.run_monitor(monitor, client, delay))
+        task.add_done_callback(functools.partial(self.monitor_done, endpoint, client))
+        self.monitors[endpoint] = (monitor, task)
+
+    async def run_monitor(self, monitor, client, delay):
+        if delay > 0:
+            await asyncio.sleep(delay)
+        await monitor.poll_for_stats(client)
+
+    def monitor_done(self, endpoint, client, task):
+        """Called when a discovered server's polling task finishes. Monitors which have failed are restarted
+        (after a delay), as long as their server is still being discovered."""
+        if task.cancelled():
+            return
+        if endpoint not in self.monitors or self.monitors[endpoint][1] is not task:
+            return
+        monitor, _ = self.monitors.pop(endpoint)
+        e = task.exception()
+        if e is None:
+            return
+        logger.error("Monitor for HAProxy server {} at {} failed: {!r}".format(monitor.id, endpoint, e))
+        if not self.must_stop:
+            logger.info("Restarting monitor for HAProxy server {} in {}s".format(monitor.id, self.restart_delay))
+            self.start_monitor(endpoint, monitor.id, client, delay=self.restart_delay)
+
+    def replay_monitor(self, monitor_id):
+        """Returns a monitor through which to replay the recorded responses of the discovered server with the
+        given ID (of the form "id/host:port"), or None if the ID does not belong to this group."""
+        prefix = "{}/".format(self.id)
+        if not monitor_id.startswith(prefix):
+            return None
+        if monitor_id not in self.replay_monitors:
+            host, port = monitor_id[len(prefix):].rsplit(":", 1)
+            self.replay_monitors[monitor_id] = self.create_monitor(monitor_id, self.endpoint_for(host, int(port)))
+        return self.replay_monitors[monitor_id]
+
+    def retire(self, endpoints):
+        for endpoint in endpoints:
+            monitor, task = self.monitors.pop(endpoint)
+            logger.info("Retiring HAProxy server {} at {}".format(monitor.id, endpoint))
+            monitor.stop()
+            task.cancel()
+
+    def stop(self):
+        self.must_stop = True
+        for monitor, _ in self.monitors.values():
+            monitor.stop()
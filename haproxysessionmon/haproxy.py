@@ -2,7 +2,9 @@
 
 import io
 import csv
-from collections import namedtuple
+import time
+import operator
+from collections import namedtuple, OrderedDict
 import asyncio
 from aiohttp import BasicAuth
 
@@ -10,7 +12,8 @@ import logging
 logger = logging.getLogger(__name__)
 
 __all__ = [
-    "HAProxyServerMonitor"
+    "HAProxyServerMonitor",
+    "ProxyMetrics"
 ]
 
 ProxyMetrics = namedtuple("ProxyMetrics", [
@@ -24,27 +27,53 @@ ProxyMetrics = namedtuple("ProxyMetrics", [
     "http_5xx"
 ])
 
+# how each metric is combined when merging the stats of multiple HAProxy processes
+PROXY_METRICS_MERGE_RULES = {
+    "sessions": operator.add,
+    "queued_sessions": operator.add,
+    # each process sees the same servers, so the counts should agree
+    "active_backends": max,
+    "http_4xx": operator.add,
+    "http_5xx": operator.add
+}
+
+UNIX_SOCKET_PREFIX = "unix://"
+
 
 class HAProxyServerMonitor(object):
     """For representing a single HAProxy server, from which we'll be pulling statistics."""
 
-    def __init__(self, id, stats_csv_endpoint, backends, auth_creds=None, update_interval=10.0):
+    def __init__(self, id, stats_csv_endpoint, backends, auth_creds=None, update_interval=10.0,
+                 include_servers=False, top_k=None, recorder=None, profiler=None):
         """Constructor.
 
         Args:
             id: A short, descriptive name/title for this HAProxy instance.
-            stats_csv_endpoint: A URL to the HAProxy endpoint to monitor.
+            stats_csv_endpoint: A URL to the HAProxy endpoint to monitor, or a list of URLs (one per HAProxy
+                process) whose stats are to be merged. URLs of the form "unix:///path/to/socket" refer to
+                HAProxy stats sockets.
             backends: A list containing one or more backends to which this server's stats are to be
                 sent once retrieved.
             auth_creds: An optional 2-tuple containing the username/password combination for accessing this
                 HAProxy instance (using HTTP Basic Authentication).
             update_interval: The interval, in seconds, between each attempt to poll the HAProxy instance
                 for stats.
+            include_servers: Whether or not to also produce metrics for the individual servers within each
+                HAProxy backend (reported with a backend name of the form "backend/server").
+            top_k: An optional TopKSelector with which to limit the number of metrics produced per poll.
+            recorder: An optional StatsArchiveWriter to which each raw stats response is to be recorded.
+            profiler: An optional LoopProfiler to which the timings of each poll are to be reported.
         """
         self.id = id
-        self.stats_csv_endpoint = stats_csv_endpoint
+        self.endpoints = [stats_csv_endpoint] if isinstance(stats_csv_endpoint, str) else list(stats_csv_endpoint)
+        self.stats_csv_endpoint = ",".join(self.endpoints)
         self.backends = backends
         self.update_interval = update_interval
+        self.include_servers = include_servers
+        self.top_k = top_k
+        self.recorder = recorder
+        self.profiler = profiler
+        self.last_parse_duration = 0.0
         self.must_stop = False
         self.auth = BasicAuth(auth_creds[0], password=auth_creds[1]) if auth_creds is not None else None
 
@@ -52,23 +81,80 @@ class HAProxyServerMonitor(object):
 
     async def fetch_stats(self, client):
         logger.debug("Fetching stats for {}".format(self.id))
-        result = []
-        async with client.get(self.stats_csv_endpoint, auth=self.auth) as response:
-            if response.status == 200:
-                result = self.parse_csv_stats(await response.text())
-            else:
-                logger.error("Failed to fetch stats from {} ({}): response {}\n{}".format(
-                    self.stats_csv_endpoint,
+        responses = await asyncio.gather(
+            *[self.fetch_endpoint_stats(client, endpoint) for endpoint in self.endpoints],
+            return_exceptions=True
+        )
+        timestamp = time.time()
+        for endpoint, csv_data in zip(self.endpoints, responses):
+            if isinstance(csv_data, Exception):
+                logger.error("Failed to fetch stats from {} ({}): {!r}".format(endpoint, self.id, csv_data))
+        csv_responses = [csv_data for csv_data in responses if isinstance(csv_data, str)]
+        if len(csv_responses) != len(self.endpoints):
+            # merging the remaining processes' stats would under-report the server's totals
+            if csv_responses:
+                logger.warning("Skipping incomplete stats for {} ({} of {} processes responded)".format(
                     self.id,
-                    response.status,
-                    await response.text()
+                    len(csv_responses),
+                    len(self.endpoints)
                 ))
+            return []
 
+        if self.recorder is not None:
+            for endpoint, csv_data in zip(self.endpoints, csv_responses):
+                # responses from the same poll share a timestamp, so that they can be merged again on replay
+                self.recorder.submit(self.id, endpoint, csv_data, timestamp=timestamp)
+
+        parse_started = time.monotonic()
+        result = self.process_csv_stats(*csv_responses)
+        self.last_parse_duration = time.monotonic() - parse_started
         return result
 
+    async def fetch_endpoint_stats(self, client, endpoint):
+        """Fetches the raw CSV stats from the given endpoint, returning None on failure."""
+        if endpoint.startswith(UNIX_SOCKET_PREFIX):
+            return await self.fetch_socket_stats(endpoint[len(UNIX_SOCKET_PREFIX):])
+
+        async with client.get(endpoint, auth=self.auth) as response:
+            if response.status == 200:
+                return await response.text()
+            logger.error("Failed to fetch stats from {} ({}): response {}\n{}".format(
+                endpoint,
+                self.id,
+                response.status,
+                await response.text()
+            ))
+        return None
+
+    async def fetch_socket_stats(self, path):
+        try:
+            reader, writer = await asyncio.open_unix_connection(path)
+        except OSError as e:
+            logger.error("Failed to connect to stats socket {} ({}): {}".format(path, self.id, e))
+            return None
+        try:
+            writer.write(b"show stat\n")
+            return (await reader.read()).decode("utf-8")
+        finally:
+            writer.close()
+
     async def poll_for_stats(self, client):
         while not self.must_stop:
-            await self.track_stats(await self.fetch_stats(client))
+            started = time.time()
+            fetch_started = time.monotonic()
+            stats = await self.fetch_stats(client)
+            store_started = time.monotonic()
+            await self.track_stats(stats)
+            if self.profiler is not None:
+                finished = time.monotonic()
+                self.profiler.record_tick(
+                    self.id,
+                    finished - fetch_started,
+                    store_started - fetch_started - self.last_parse_duration,
+                    self.last_parse_duration,
+                    finished - store_started,
+                    started
+                )
             await asyncio.sleep(self.update_interval)
 
     async def track_stats(self, stats):
@@ -81,19 +167,53 @@ class HAProxyServerMonitor(object):
         # graceful attempt to stop this process
         self.must_stop = True
 
+    def process_csv_stats(self, *csv_responses):
+        """Parses the given raw stats, merging the responses from multiple HAProxy processes and applying
+        top-K selection if configured for this server."""
+        if len(csv_responses) == 1:
+            stats = self.iter_csv_stats(csv_responses[0])
+        else:
+            stats = self.merge_stats(*[self.iter_csv_stats(csv_data) for csv_data in csv_responses])
+        if self.top_k is not None:
+            return self.top_k.select(stats)
+        return list(stats)
+
+    def merge_stats(self, *process_stats):
+        """Merges the metrics from multiple HAProxy processes per backend."""
+        merged = OrderedDict()
+        for stats in process_stats:
+            for metric in stats:
+                current = merged.get(metric.backend)
+                if current is None:
+                    merged[metric.backend] = metric
+                else:
+                    merged[metric.backend] = current._replace(**{
+                        field: rule(getattr(current, field), getattr(metric, field))
+                        for field, rule in PROXY_METRICS_MERGE_RULES.items()
+                    })
+        return list(merged.values())
+
     def parse_csv_stats(self, csv_data):
+        return list(self.iter_csv_stats(csv_data))
+
+    def iter_csv_stats(self, csv_data):
         reader = csv.DictReader(io.StringIO(csv_data))
-        stats = []
         for row in reader:
-            if '# pxname' in row and 'svname' in row and 'rate' in row and row['svname'] == "BACKEND":
-                stats.append(ProxyMetrics(
-                    server_id=self.id,
-                    endpoint=self.stats_csv_endpoint,
-                    backend=row['# pxname'],
-                    sessions=int(row['rate']) if row['rate'] else 0,
-                    queued_sessions=int(row['qcur']) if row['qcur'] else 0,
-                    active_backends=int(row['act']) if row['act'] else 0,
-                    http_4xx=int(row['hrsp_4xx']) if row['hrsp_4xx'] else 0,
-                    http_5xx=int(row['hrsp_5xx']) if row['hrsp_5xx'] else 0
-                ))
-        return stats
+            if '# pxname' not in row or 'svname' not in row or 'rate' not in row:
+                continue
+            if row['svname'] == "BACKEND":
+                backend = row['# pxname']
+            elif self.include_servers and row['svname'] != "FRONTEND":
+                backend = "{}/{}".format(row['# pxname'], row['svname'])
+            else:
+                continue
+            yield ProxyMetrics(
+                server_id=self.id,
+                endpoint=self.stats_csv_endpoint,
+                backend=backend,
+                sessions=int(row['rate']) if row['rate'] else 0,
+                queued_sessions=int(row['qcur']) if row['qcur'] else 0,
+                active_backends=int(row['act']) if row['act'] else 0,
+                http_4xx=int(row['hrsp_4xx']) if row['hrsp_4xx'] else 0,
+                http_5xx=int(row['hrsp_5xx']) if row['hrsp_5xx'] else 0
+            )
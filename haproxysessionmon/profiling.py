@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import time
+import heapq
+import asyncio
+import threading
+from collections import Counter, deque, namedtuple
+
+import logging
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    "LoopProfiler",
+    "TickTiming"
+]
+
+# how far back, in seconds, recent stack samples are kept for explaining loop stalls
+PROFILER_RECENT_SAMPLES_SPAN = 10.0
+
+TickTiming = namedtuple("TickTiming", [
+    "total",
+    "fetch",
+    "parse",
+    "store",
+    "started"
+])
+
+
+def collapse_stack(frame):
+    """Collapses the given frame's stack into a single line, outermost frame first (the format expected by
+    flamegraph tools)."""
+    names = []
+    while frame is not None:
+        names.append("{}:{}".format(os.path.basename(frame.f_code.co_filename), frame.f_code.co_name))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class LoopProfiler(object):
+    """Low-overhead diagnostics for the event loop: a loop-lag probe, a sampling profiler over the loop's
+    thread, and per-monitor timings of the slowest polling ticks. Results are written to the output
+    directory each time profiling is stopped."""
+
+    def __init__(self, loop, output_dir, sample_interval=0.01, lag_interval=0.25, lag_threshold=0.1,
+                 slowest_ticks=10):
+        """Constructor.
+
+        Args:
+            loop: The event loop to profile.
+            output_dir: The directory to which to write the profiling results.
+            sample_interval: The interval, in seconds, between stack samples.
+            lag_interval: The interval, in seconds, between loop lag probes.
+            lag_threshold: The loop lag, in seconds, beyond which a warning is logged.
+            slowest_ticks: The number of slowest ticks to keep per monitor.
+        """
+        self.loop = loop
+        self.output_dir = output_dir
+        self.sample_interval = sample_interval
+        self.lag_interval = lag_interval
+        self.lag_threshold = lag_threshold
+        self.slowest_ticks = slowest_ticks
+        self.active = False
+        self.reset()
+
+    def reset(self):
+        self.samples = Counter()
+        # (time, collapsed stack) of the most recent samples
+        self.recent = deque(maxlen=max(1, int(PROFILER_RECENT_SAMPLES_SPAN / self.sample_interval)))
+        # monitor ID -> min-heap of TickTiming tuples
+        self.ticks = dict()
+        self.lag_count = 0
+        self.lag_total = 0.0
+        self.lag_max = 0.0
+        self.lag_over_threshold = 0
+        self.started = None
+        self.sampler = None
+        self.sampler_stop = None
+        self.lag_probe = None
+
+    def toggle(self):
+        if self.active:
+            self.stop()
+        else:
+            self.start()
+
+    def start(self):
+        if self.active:
+            return
+        self.reset()
+        self.active = True
+        self.started = time.time()
+        self.sampler_stop = threading.Event()
+        self.sampler = threading.Thread(
+            target=self.sample,
+            args=(threading.get_ident(), self.sampler_stop),
+            name="haproxysessionmon-profiler",
+            daemon=True
+        )
+        self.sampler.start()
+        self.lag_probe = asyncio.ensure_future(self.probe_lag(), loop=self.loop)
+        logger.info("Profiling started")
+
+    def stop(self):
+        if not self.active:
+            return
+        self.active = False
+        self.sampler_stop.set()
+        self.sampler.join()
+        self.lag_probe.cancel()
+        if not self.loop.is_running():
+            # let the probe finish, rather than leaving it pending when the loop is closed
+            try:
+                self.loop.run_until_complete(self.lag_probe)
+            except asyncio.CancelledError:
+                pass
+        self.write_results()
+        logger.info("Profiling stopped")
+
+    def sample(self, thread_id, stop):
+        while not stop.wait(self.sample_interval):
+            frame = sys._current_frames().get(thread_id)
+            if frame is not None:
+                stack = collapse_stack(frame)
+                self.samples[stack] += 1
+                self.recent.append((time.monotonic(), stack))
+
+    async def probe_lag(self):
+        while True:
+            expected = self.loop.time() + self.lag_interval
+            await asyncio.sleep(self.lag_interval)
+            lag = max(0.0, self.loop.time() - expected)
+            self.lag_count += 1
+            self.lag_total += lag
+            self.lag_max = max(self.lag_max, lag)
+            if lag > self.lag_threshold:
+                self.lag_over_threshold += 1
+                stack = self.stalled_stack(expected)
+                if stack is not None:
+                    logger.warning("Event loop lagging by {:.3f}s, most often in: {}".format(lag, stack))
+                else:
+                    logger.warning("Event loop lagging by {:.3f}s".format(lag))
+
+    def stalled_stack(self, since):
+        """Returns the stack sampled most often since the given loop time (i.e. while the loop was stalled),
+        or None if no stacks were sampled in that time."""
+        # the default event loop's clock is time.monotonic, as is the sampler's
+        stalled = Counter(stack for sampled, stack in list(self.recent) if sampled >= since)
+        return stalled.most_common(1)[0][0] if stalled else None
+
+    def record_tick(self, monitor_id, total, fetch, parse, store, started):
+        if not self.active:
+            return
+        ticks = self.ticks.setdefault(monitor_id, [])
+        timing = TickTiming(total, fetch, parse, store, started)
+        if len(ticks) < self.slowest_ticks:
+            heapq.heappush(ticks, timing)
+        elif timing > ticks[0]:
+            heapq.heapreplace(ticks, timing)
+
+    def results_path(self):
+        """Returns the path (without extension) to which to write the results of the current profiling
+        window, never overwriting the results of earlier windows."""
+        name = "profile-{}-{:03d}".format(
+            time.strftime("%Y%m%d-%H%M%S", time.localtime(self.started)),
+            int(self.started * 1000) % 1000
+        )
+        path = os.path.join(self.output_dir, name)
+        count = 1
+        while os.path.exists(path + ".collapsed") or os.path.exists(path + ".txt"):
+            count += 1
+            path = os.path.join(self.output_dir, "{}-{}".format(name, count))
+        return path
+
+    def write_results(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = self.results_path()
+
+        stacks_file = path + ".collapsed"
+        with open(stacks_file, "wt", encoding="utf-8") as f:
+            for stack, count in self.samples.most_common():
+                f.write("{} {}\n".format(stack, count))
+
+        summary_file = path + ".txt"
+        with open(summary_file, "wt", encoding="utf-8") as f:
+            f.write("Profiled for {:.1f}s, {} stack sample(s)\n".format(
+                time.time() - self.started,
+                sum(self.samples.values())
+            ))
+            f.write("Event loop lag: max {:.3f}s, mean {:.3f}s, {} of {} probe(s) over {:.3f}s\n\n".format(
+                self.lag_max,
+                self.lag_total / self.lag_count if self.lag_count else 0.0,
+                self.lag_over_threshold,
+                self.lag_count,
+                self.lag_threshold
+            ))
+            f.write("monitor\ttotal\tfetch\tparse\tstore\tstarted\n")
+            for monitor_id in sorted(self.ticks.keys()):
+                for timing in sorted(self.ticks[monitor_id], reverse=True):
+                    f.write("{}\t{:.4f}\t{:.4f}\t{:.4f}\t{:.4f}\t{}\n".format(
+                        monitor_id,
+                        timing.total,
+                        timing.fetch,
+                        timing.parse,
+                        timing.store,
+                        time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timing.started))
+                    ))
+
+        logger.info("Wrote profiling results to {} and {}".format(stacks_file, summary_file))
@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import mmap
+import time
+import struct
+from collections import namedtuple
+
+import logging
+logger = logging.getLogger(__name__)
+
+__all__ = [
+    "SharedSnapshotWriter",
+    "SharedSnapshotReader",
+    "SharedSnapshotRow",
+    "SHM_DEFAULT_CAPACITY",
+    "SHM_DEFAULT_EXPIRY"
+]
+
+SHM_MAGIC = b"HASMSHM1"
+SHM_VERSION = 1
+SHM_DEFAULT_CAPACITY = 4096
+# the time, in seconds, after which the rows of a server that has stopped reporting are removed
+SHM_DEFAULT_EXPIRY = 60.0
+
+# magic, version, capacity, slot size, snapshot sequence counter (odd while a snapshot is being published)
+SHM_HEADER = struct.Struct("<8sIIIxxxxQ")
+SHM_HEADER_SIZE = 64
+SHM_GENERATION_OFFSET = 24
+
+# sequence counter, flags, timestamp, server ID, backend, sessions, queued sessions, active backends, 4xx, 5xx
+SHM_SLOT = struct.Struct("<QIxxxxd64s128s5q")
+SHM_SEQUENCE = struct.Struct("<Q")
+SHM_SLOT_OCCUPIED = 1
+
+# stored in place of metric values which are missing (e.g. the counters of merged summaries) or which are not
+# integers that fit into a slot
+SHM_MISSING_VALUE = -2 ** 63
+SHM_INT_MAX = 2 ** 63 - 1
+
+# the number of attempts made at reading a slot that is being written to
+SHM_READ_ATTEMPTS = 100
+# the number of attempts made at reading a consistent snapshot, and the delay between attempts (in seconds)
+SHM_SNAPSHOT_ATTEMPTS = 1000
+SHM_SNAPSHOT_RETRY_DELAY = 0.001
+
+SharedSnapshotRow = namedtuple("SharedSnapshotRow", [
+    "server_id",
+    "backend",
+    "timestamp",
+    "sessions",
+    "queued_sessions",
+    "active_backends",
+    "http_4xx",
+    "http_5xx"
+])
+
+
+def shm_file_size(capacity):
+    return SHM_HEADER_SIZE + capacity * SHM_SLOT.size
+
+
+def encode_value(value):
+    if value is None or isinstance(value, bool):
+        return SHM_MISSING_VALUE
+    try:
+        value = int(value)
+    except (TypeError, ValueError, OverflowError):
+        return SHM_MISSING_VALUE
+    return value if SHM_MISSING_VALUE < value <= SHM_INT_MAX else SHM_MISSING_VALUE
+
+
+def decode_value(value):
+    return None if value == SHM_MISSING_VALUE else value
+
+
+def encode_name(name, size):
+    # truncate on a character boundary
+    encoded = name.encode("utf-8")
+    while len(encoded) > size:
+        name = name[:-1]
+        encoded = name.encode("utf-8")
+    return encoded
+
+
+class SharedSnapshotWriter(object):
+    """Publishes the latest metrics for every server and backend into a fixed-layout memory-mapped file.
+
+    Each row lives in its own fixed-size slot, guarded by a sequence counter (a seqlock): the counter is odd
+    while the slot is being written to, so readers in other processes can detect (and retry) torn reads
+    without any locking. The snapshot as a whole is guarded in the same way by a sequence counter in the
+    header, so that readers never mix rows from different snapshots.
+
+    The rows of servers that have not published within the expiry period are removed, freeing their slots
+    for servers that appear later on.
+    """
+
+    def __init__(self, path, capacity=SHM_DEFAULT_CAPACITY, expiry=SHM_DEFAULT_EXPIRY):
+        self.path = path
+        self.capacity = capacity
+        self.expiry = expiry
+        self.size = shm_file_size(capacity)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            os.ftruncate(fd, self.size)
+            self.map = mmap.mmap(fd, self.size, access=mmap.ACCESS_WRITE)
+        finally:
+            os.close(fd)
+        self.map[:self.size] = b"\x00" * self.size
+        SHM_HEADER.pack_into(self.map, 0, SHM_MAGIC, SHM_VERSION, capacity, SHM_SLOT.size, 0)
+        self.sequence = 0
+        # (server ID, backend) -> slot number
+        self.slots = dict()
+        self.free_slots = list(range(capacity - 1, -1, -1))
+        # server ID -> set of backends in that server's latest snapshot
+        self.server_backends = dict()
+        # server ID -> timestamp of that server's latest snapshot
+        self.last_published = dict()
+        self.warned_full = False
+        logger.info("Publishing snapshots to shared memory file {} ({} slots)".format(path, capacity))
+
+    @property
+    def generation(self):
+        return self.sequence // 2
+
+    def publish(self, stats, timestamp=None):
+        timestamp = time.time() if timestamp is None else timestamp
+        snapshots = dict()
+        for metric in stats:
+            snapshots.setdefault(metric.server_id, []).append(metric)
+
+        self.sequence += 1
+        SHM_SEQUENCE.pack_into(self.map, SHM_GENERATION_OFFSET, self.sequence)
+        try:
+            self.expire(timestamp)
+            for server_id, metrics in snapshots.items():
+                backends = set()
+                for metric in metrics:
+                    self.write_row(metric, timestamp)
+                    backends.add(metric.backend)
+                # clear the rows of backends which have disappeared from this server's snapshot
+                for backend in self.server_backends.get(server_id, set()) - backends:
+                    self.clear_row(server_id, backend)
+                self.server_backends[server_id] = backends
+                self.last_published[server_id] = timestamp
+        finally:
+            self.sequence += 1
+            SHM_SEQUENCE.pack_into(self.map, SHM_GENERATION_OFFSET, self.sequence)
+
+    def expire(self, now):
+        """Removes the rows of all servers that have not published within the expiry period."""
+        for server_id, last_published in list(self.last_published.items()):
+            if now - last_published > self.expiry:
+                for backend in self.server_backends.pop(server_id):
+                    self.clear_row(server_id, backend)
+                del self.last_published[server_id]
+                logger.info("Removed expired server {} from shared memory file {}".format(server_id, self.path))
+
+    def slot_offset(self, slot):
+        return SHM_HEADER_SIZE + slot * SHM_SLOT.size
+
+    def write_row(self, metric, timestamp):
+        key = (metric.server_id, metric.backend)
+        if key not in self.slots:
+            if not self.free_slots:
+                if not self.warned_full:
+                    logger.warning("Shared memory file {} is full, dropping rows".format(self.path))
+                    self.warned_full = True
+                return
+            self.slots[key] = self.free_slots.pop()
+
+        offset = self.slot_offset(self.slots[key])
+        sequence = SHM_SEQUENCE.unpack_from(self.map, offset)[0]
+        SHM_SEQUENCE.pack_into(self.map, offset, sequence + 1)
+        try:
+            SHM_SLOT.pack_into(
+                self.map,
+                offset,
+                sequence + 1,
+                SHM_SLOT_OCCUPIED,
+                timestamp,
+                encode_name(metric.server_id, 64),
+                encode_name(metric.backend, 128),
+                encode_value(metric.sessions),
+                encode_value(metric.queued_sessions),
+                encode_value(metric.active_backends),
+                encode_value(metric.http_4xx),
+                encode_value(metric.http_5xx)
+            )
+        finally:
+            # readers must never see the slot as being written to forever
+            SHM_SEQUENCE.pack_into(self.map, offset, sequence + 2)
+
+    def clear_row(self, server_id, backend):
+        slot = self.slots.pop((server_id, backend), None)
+        if slot is None:
+            return
+        offset = self.slot_offset(slot)
+        sequence = SHM_SEQUENCE.unpack_from(self.map, offset)[0]
+        SHM_SEQUENCE.pack_into(self.map, offset, sequence + 1)
+        self.map[offset + SHM_SEQUENCE.size:offset + SHM_SLOT.size] = b"\x00" * (SHM_SLOT.size - SHM_SEQUENCE.size)
+        SHM_SEQUENCE.pack_into(self.map, offset, sequence + 2)
+        self.free_slots.append(slot)
+
+    def close(self):
+        self.map.close()
+
+
+class SharedSnapshotReader(object):
+    """Reads consistent rows from a shared memory file published by a SharedSnapshotWriter."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.capacity, slot_size, _ = SHM_HEADER.unpack_from(self.map, 0)
+        if magic != SHM_MAGIC or version != SHM_VERSION or slot_size != SHM_SLOT.size:
+            self.map.close()
+            raise ValueError("Not a shared memory snapshot file: {}".format(path))
+
+    @property
+    def sequence(self):
+        return SHM_SEQUENCE.unpack_from(self.map, SHM_GENERATION_OFFSET)[0]
+
+    @property
+    def generation(self):
+        """The number of snapshots published so far."""
+        return self.sequence // 2
+
+    def read_slot(self, slot):
+        """Reads the row in the given slot, returning None if the slot is empty (or is continually being
+        written to)."""
+        offset = SHM_HEADER_SIZE + slot * SHM_SLOT.size
+        for _ in range(SHM_READ_ATTEMPTS):
+            before = SHM_SEQUENCE.unpack_from(self.map, offset)[0]
+            if before % 2:
+                continue
+            fields = SHM_SLOT.unpack_from(self.map, offset)
+            if SHM_SEQUENCE.unpack_from(self.map, offset)[0] != before or fields[0] != before:
+                continue
+            if not fields[1] & SHM_SLOT_OCCUPIED:
+                return None
+            return SharedSnapshotRow(
+                fields[3].rstrip(b"\x00").decode("utf-8"),
+                fields[4].rstrip(b"\x00").decode("utf-8"),
+                fields[2],
+                *[decode_value(value) for value in fields[5:]]
+            )
+        return None
+
+    def read(self):
+        """Reads all of the rows of the latest published snapshot, retrying while a snapshot is being
+        published.
+
+        Raises:
+            RuntimeError: If no consistent snapshot could be read.
+        """
+        for _ in range(SHM_SNAPSHOT_ATTEMPTS):
+            before = self.sequence
+            if not before % 2:
+                rows = []
+                for slot in range(self.capacity):
+                    row = self.read_slot(slot)
+                    if row is not None:
+                        rows.append(row)
+                if self.sequence == before:
+                    return rows
+            time.sleep(SHM_SNAPSHOT_RETRY_DELAY)
+        raise RuntimeError("Timed out waiting for a consistent snapshot in {}".format(self.path))
+
+    def close(self):
+        self.map.close()
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Dumps the metrics published by the HAProxy Session Monitor "
+                                                 "to a shared memory file.")
+    parser.add_argument("path", help="Full path to the shared memory file.")
+    parser.add_argument(
+        "-w", "--watch",
+        type=float,
+        metavar="INTERVAL",
+        help="Continuously dump the metrics at the given interval (in seconds)."
+    )
+    args = parser.parse_args()
+
+    try:
+        reader = SharedSnapshotReader(args.path)
+    except (OSError, ValueError) as e:
+        print(e)
+        sys.exit(1)
+
+    try:
+        while True:
+            print("\t".join(SharedSnapshotRow._fields))
+            try:
+                rows = reader.read()
+            except RuntimeError as e:
+                print(e)
+                rows = []
+            for row in sorted(rows):
+                print("\t".join(str(value) for value in row))
+            if args.watch is None:
+                break
+            time.sleep(args.watch)
+            print()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        reader.close()
+
+
+if __name__ == "__main__":
+    main()
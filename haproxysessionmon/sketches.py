@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+
+import math
+
+__all__ = [
+    "QuantileSketch"
+]
+
+
+class QuantileSketch(object):
+    """A mergeable, fixed-memory quantile sketch for non-negative values (in the style of DDSketch).
+
+    Values are counted in logarithmically sized bins, such that any quantile can be estimated to within the
+    configured relative accuracy. Should the number of bins exceed the configured maximum, the lowest bins
+    are collapsed into one another, sacrificing accuracy for the lowest quantiles only.
+    """
+
+    def __init__(self, relative_accuracy=0.01, max_bins=2048):
+        """Constructor.
+
+        Args:
+            relative_accuracy: The relative accuracy guaranteed for quantile estimates (between 0 and 1).
+            max_bins: The maximum number of bins to keep.
+        """
+        if not 0.0 < relative_accuracy < 1.0:
+            raise ValueError("Relative accuracy must be between 0 and 1")
+        self.relative_accuracy = relative_accuracy
+        self.max_bins = max_bins
+        self.gamma = (1.0 + relative_accuracy) / (1.0 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        # bin key -> count
+        self.bins = dict()
+        self.zero_count = 0
+        self.count = 0
+        self.min = None
+        self.max = None
+
+    def add(self, value, count=1):
+        if value < 0:
+            raise ValueError("Quantile sketches only support non-negative values")
+        if value == 0:
+            self.zero_count += count
+        else:
+            key = int(math.ceil(math.log(value) / self.log_gamma))
+            self.bins[key] = self.bins.get(key, 0) + count
+            if len(self.bins) > self.max_bins:
+                self.collapse()
+        self.count += count
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def collapse(self):
+        keys = sorted(self.bins.keys())
+        excess = len(keys) - self.max_bins
+        if excess <= 0:
+            return
+        target = keys[excess]
+        for key in keys[:excess]:
+            self.bins[target] += self.bins.pop(key)
+
+    def merge(self, other):
+        """Merges the given sketch (which must have the same relative accuracy) into this one."""
+        if other.gamma != self.gamma:
+            raise ValueError("Cannot merge quantile sketches with different relative accuracies")
+        for key, count in other.bins.items():
+            self.bins[key] = self.bins.get(key, 0) + count
+        self.collapse()
+        self.zero_count += other.zero_count
+        self.count += other.count
+        if other.count:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+        return self
+
+    def quantile(self, q):
+        """Estimates the value at the given quantile (between 0 and 1), or returns None if the sketch is
+        empty."""
+        if self.count == 0:
+            return None
+        # the extremes are tracked exactly
+        if q <= 0.0:
+            return self.min
+        if q >= 1.0:
+            return self.max
+        rank = q * (self.count - 1)
+        if rank < self.zero_count:
+            return 0
+        seen = self.zero_count
+        for key in sorted(self.bins.keys()):
+            seen += self.bins[key]
+            if seen > rank:
+                value = 2.0 * self.gamma ** key / (self.gamma + 1.0)
+                return max(self.min, min(self.max, value))
+        return self.max
+
+    def to_dict(self):
+        """Serialises this sketch, e.g. for merging with sketches from other workers."""
+        return {
+            "relative_accuracy": self.relative_accuracy,
+            "max_bins": self.max_bins,
+            "bins": [[key, count] for key, count in sorted(self.bins.items())],
+            "zero_count": self.zero_count,
+            "count": self.count,
+            "min": self.min,
+            "max": self.max
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        sketch = cls(relative_accuracy=d['relative_accuracy'], max_bins=d['max_bins'])
+        sketch.bins = {key: count for key, count in d['bins']}
+        sketch.zero_count = d['zero_count']
+        sketch.count = d['count']
+        sketch.min = d['min']
+        sketch.max = d['max']
+        return sketch
@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+
+from haproxysessionmon.haproxy import ProxyMetrics
+from haproxysessionmon.backends.base import StorageBackend
+
+__all__ = [
+    "MemoryBackend",
+    "FakeClock",
+    "metric"
+]
+
+
+def metric(server_id, backend, sessions=0, queued_sessions=0, active_backends=1, http_4xx=0, http_5xx=0):
+    return ProxyMetrics(
+        server_id,
+        "http://{}/stats".format(server_id),
+        backend,
+        sessions,
+        queued_sessions,
+        active_backends,
+        http_4xx,
+        http_5xx
+    )
+
+
+class MemoryBackend(StorageBackend):
+    """Keeps each batch of stats it is asked to store."""
+
+    def __init__(self):
+        self.stored = []
+
+    @property
+    def rows(self):
+        return [row for batch in self.stored for row in batch]
+
+    async def store_stats(self, stats):
+        self.stored.append(stats)
+        return len(stats)
+
+
+class FakeClock(object):
+    """A clock which only moves when told to."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import unittest
+from haproxysessionmon.backends.aggregate import *
+from haproxysessionmon.tests.helpers import *
+
+
+class TestFleetAggregateBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.clock = FakeClock()
+        self.target = MemoryBackend()
+        self.aggregate = FleetAggregateBackend("fleet", [self.target], update_interval=10.0, expiry=30.0,
+                                               clock=self.clock)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def store(self, stats):
+        return self.loop.run_until_complete(self.aggregate.store_stats(stats))
+
+    def test_aggregates_latest_snapshot_per_server(self):
+        self.store([metric("lb1", "api", 5, 1), metric("lb1", "web", 2)])
+        self.store([metric("lb2", "api", 7, 3)])
+        # a newer snapshot from the same server replaces its previous contribution
+        self.store([metric("lb1", "api", 1, 0), metric("lb1", "web", 2)])
+        self.assertEqual([], self.target.stored)
+
+        self.clock.now = 10.0
+        self.store([])
+        self.assertEqual(1, len(self.target.stored))
+        rows = {row.backend: row for row in self.target.stored[0]}
+        self.assertEqual({"api", "web"}, set(rows.keys()))
+        self.assertEqual("fleet", rows["api"].server_id)
+        self.assertEqual(8, rows["api"].sessions)
+        self.assertEqual(3, rows["api"].queued_sessions)
+        self.assertEqual(2, rows["api"].nodes)
+        self.assertEqual(7, rows["api"].sessions_max)
+        self.assertEqual(1, rows["api"].sessions_min)
+        self.assertEqual(1, rows["web"].nodes)
+
+    def test_backend_removed_from_server_snapshot(self):
+        self.store([metric("lb1", "api", 5), metric("lb1", "web", 2)])
+        self.store([metric("lb1", "api", 5)])
+        self.clock.now = 10.0
+        self.store([])
+        self.assertEqual(["api"], [row.backend for row in self.target.stored[0]])
+
+    def test_stale_servers_expire(self):
+        self.store([metric("lb1", "api", 5)])
+        self.clock.now = 20.0
+        self.store([metric("lb2", "api", 3)])
+        self.assertEqual(8, self.target.stored[-1][0].sessions)
+
+        self.clock.now = 40.0
+        self.store([metric("lb2", "api", 3)])
+        self.assertEqual(3, self.target.stored[-1][0].sessions)
+        self.assertEqual(1, self.target.stored[-1][0].nodes)
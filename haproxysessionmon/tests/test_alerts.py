@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import os
+import shutil
+import tempfile
+import unittest
+
+from haproxysessionmon.alerts import *
+from haproxysessionmon.backends.shm import SharedMemoryBackend
+from haproxysessionmon.tests.helpers import *
+
+
+class TestAlertEngine(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.target = MemoryBackend()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def store(self, engine, stats):
+        return self.loop.run_until_complete(engine.store_stats(stats))
+
+    def test_compile_condition(self):
+        condition = compile_condition("queued_sessions >= 50")
+        self.assertEqual(("queued_sessions", False, 50.0), (condition.metric, condition.delta, condition.threshold))
+        self.assertTrue(compile_condition("http_5xx_delta > 2").delta)
+        for text in ["queued_sessions", "unknown > 5", "sessions >> 5", "sessions > abc"]:
+            with self.assertRaises(ValueError):
+                compile_condition(text)
+
+    def test_fires_after_consecutive_ticks_with_hysteresis(self):
+        engine = AlertEngine([
+            AlertRule("queue", "queued_sessions > 50", [self.target], backend_pattern="api*", for_ticks=3,
+                      clear_condition="queued_sessions < 40", clear_ticks=2)
+        ])
+        for queued in [60, 60, 10, 60, 60]:
+            self.store(engine, [
+                metric("lb1", "api-1", queued_sessions=queued),
+                metric("lb1", "web", queued_sessions=100)
+            ])
+        self.assertEqual([], self.target.rows)
+
+        self.store(engine, [metric("lb1", "api-1", queued_sessions=60)])
+        self.assertEqual([("queue", "api-1", ALERT_STATE_FIRING)],
+                         [(e.alert, e.backend, e.state) for e in self.target.rows])
+
+        # no duplicate events while firing, and values between the thresholds don't resolve the alert
+        for queued in [70, 45, 30, 45, 30]:
+            self.store(engine, [metric("lb1", "api-1", queued_sessions=queued)])
+        self.assertEqual(1, len(self.target.rows))
+
+        self.store(engine, [metric("lb1", "api-1", queued_sessions=30)])
+        self.assertEqual(ALERT_STATE_RESOLVED, self.target.rows[-1].state)
+        self.assertEqual(30, self.target.rows[-1].value)
+        self.assertEqual({}, engine.states)
+
+    def test_delta_conditions(self):
+        engine = AlertEngine([AlertRule("errors", "http_5xx_delta > 5", [self.target], backend_pattern="api")])
+        self.store(engine, [metric("lb1", "api", http_5xx=100)])
+        self.store(engine, [metric("lb1", "api", http_5xx=103)])
+        self.assertEqual([], self.target.rows)
+        self.store(engine, [metric("lb1", "api", http_5xx=110)])
+        self.assertEqual([7], [e.value for e in self.target.rows])
+
+    def test_servers_that_stop_reporting_expire(self):
+        clock = FakeClock()
+        engine = AlertEngine([AlertRule("queue", "queued_sessions > 50", [self.target]),
+                              AlertRule("errors", "http_5xx_delta > 5", [self.target])], expiry=30.0, clock=clock)
+        self.store(engine, [metric("lb1", "api", queued_sessions=60), metric("lb2", "api", queued_sessions=60)])
+        self.assertEqual(2, len(self.target.rows))
+
+        clock.now = 20.0
+        self.store(engine, [metric("lb2", "api", queued_sessions=60)])
+        clock.now = 31.0
+        self.store(engine, [metric("lb2", "api", queued_sessions=60)])
+        event = self.target.rows[-1]
+        self.assertEqual(("lb1", "api", ALERT_STATE_RESOLVED, 60, None),
+                         (event.server_id, event.backend, event.state, event.queued_sessions, event.value))
+        self.assertEqual(3, len(self.target.rows))
+        self.assertEqual([("queue", "lb2", "api")], list(engine.states.keys()))
+        self.assertEqual([("lb2", "api")], list(engine.matches.keys()))
+        self.assertEqual([("lb2", "api")], list(engine.previous.keys()))
+        self.assertEqual(["lb2"], list(engine.last_seen.keys()))
+
+    def test_snapshot_backends_rejected(self):
+        tmpdir = tempfile.mkdtemp()
+        shm = SharedMemoryBackend(os.path.join(tmpdir, "snapshot.shm"), capacity=4)
+        try:
+            # an alert event stored as a snapshot would replace all of the server's other rows
+            with self.assertRaises(ValueError):
+                AlertRule("queue", "queued_sessions > 50", [self.target, shm])
+        finally:
+            shm.close()
+            shutil.rmtree(tmpdir)
+
+    def test_rule_index(self):
+        rules = [AlertRule("exact", "sessions > 0", [], backend_pattern="api"),
+                 AlertRule("prefix", "sessions > 0", [], backend_pattern="api-*"),
+                 AlertRule("all", "sessions > 0", []),
+                 AlertRule("server", "sessions > 0", [], server_pattern="lb2")]
+        rules += [AlertRule("other{}".format(i), "sessions > 0", [], backend_pattern="web{}-*".format(i))
+                  for i in range(1000)]
+        engine = AlertEngine(rules)
+        self.assertEqual({"exact", "all"}, {rule.name for rule in engine.match("lb1", "api")})
+        self.assertEqual({"prefix", "all"}, {rule.name for rule in engine.match("lb1", "api-1")})
+        self.assertEqual({"prefix", "all", "server"}, {rule.name for rule in engine.match("lb2", "api-1")})
+        self.assertEqual({"all", "other42"}, {rule.name for rule in engine.match("lb1", "web42-a")})
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+from haproxysessionmon.archive import *
+from haproxysessionmon.haproxy import HAProxyServerMonitor
+from haproxysessionmon.backends.summary import SummaryBackend
+from haproxysessionmon.core import replay_archive
+from haproxysessionmon.tests.helpers import MemoryBackend
+
+
+class TestStatsArchive(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), "stats.gz")
+
+    def tearDown(self):
+        shutil.rmtree(os.path.dirname(self.path))
+
+    def write_records(self, count, start=0):
+        writer = StatsArchiveWriter(self.path)
+        for i in range(start, start + count):
+            writer.record("lb{}".format(i % 2), "http://lb/stats", "# pxname,svname\napi,BACKEND{}\n".format(i),
+                          timestamp=1000.0 + i)
+        writer.close()
+
+    def test_round_trip(self):
+        self.write_records(5)
+        # the writer appends to existing archives
+        self.write_records(5, start=5)
+
+        reader = StatsArchiveReader(self.path)
+        self.assertEqual(10, len(reader))
+        records = list(reader)
+        self.assertEqual([1000.0 + i for i in range(10)], [record.timestamp for record in records])
+        self.assertEqual("lb1", records[3].server_id)
+        self.assertEqual("# pxname,svname\napi,BACKEND3\n", records[3].csv_data)
+        reader.close()
+
+        # the archive is readable as a plain gzip file
+        with gzip.open(self.path, "rt") as f:
+            self.assertEqual(10, len([line for line in f.read().splitlines() if line.startswith("{")]))
+
+    def test_seek_by_timestamp(self):
+        self.write_records(100)
+        reader = StatsArchiveReader(self.path)
+        self.assertEqual(42, reader.find(1042.0))
+        self.assertEqual(43, reader.find(1042.5))
+        self.assertEqual(100, reader.find(5000.0))
+        records = list(reader.iter_records(start=1090.0, end=1095.0))
+        self.assertEqual([1090.0, 1091.0, 1092.0, 1093.0, 1094.0], [record.timestamp for record in records])
+        reader.close()
+
+    def test_recovers_from_partial_writes(self):
+        self.write_records(1)
+        # simulate a crash part way through writing the next record
+        with open(self.path, "ab") as f:
+            f.write(b"\x1f\x8b\x08junk")
+        with open(self.path + ".idx", "ab") as f:
+            f.write(b"\x00" * 7)
+
+        with self.assertLogs("haproxysessionmon.archive", level="WARNING"):
+            self.write_records(1, start=1)
+        reader = StatsArchiveReader(self.path)
+        self.assertEqual(2, len(reader))
+        self.assertEqual([1000.0, 1001.0], [record.timestamp for record in reader])
+        reader.close()
+
+    def test_background_recording(self):
+        writer = StatsArchiveWriter(self.path)
+        futures = [writer.submit("lb1", "http://lb/stats", "api,BACKEND{}\n".format(i), timestamp=1000.0 + i)
+                   for i in range(20)]
+        writer.close()
+        self.assertTrue(all(future.done() for future in futures))
+        reader = StatsArchiveReader(self.path)
+        self.assertEqual([1000.0 + i for i in range(20)], [record.timestamp for record in reader])
+        reader.close()
+
+    def test_replay_follows_recorded_time(self):
+        # an hour of polls, every 10 seconds
+        writer = StatsArchiveWriter(self.path)
+        for i in range(360):
+            writer.record("lb1", "http://lb1/stats", "# pxname,svname,qcur,act,rate,hrsp_4xx,hrsp_5xx\n"
+                          "api,BACKEND,0,1,{},0,0\n".format(i), timestamp=1000.0 + i * 10)
+        writer.close()
+
+        loop = asyncio.new_event_loop()
+        clock = ReplayClock()
+        target = MemoryBackend()
+        summary = SummaryBackend("summary", [target], window=600.0, clock=clock)
+        monitors = {"lb1": HAProxyServerMonitor("lb1", "http://lb1/stats", [summary])}
+        reader = StatsArchiveReader(self.path)
+        self.assertEqual(360, loop.run_until_complete(replay_archive(reader, monitors, speed=0, clock=clock)))
+        reader.close()
+        loop.close()
+
+        # five full windows, plus the partial window flushed at the end of the replay
+        self.assertEqual(6, len(target.stored))
+        self.assertEqual(360, sum(row.samples for row in target.rows))
+        self.assertEqual(359, target.rows[-1].sessions)
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import json
+import unittest
+
+from haproxysessionmon.broadcast import *
+from haproxysessionmon.tests.helpers import FakeClock, metric
+
+
+class TestSnapshotBroadcaster(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.clock = FakeClock()
+        self.broadcaster = SnapshotBroadcaster(max_pending=2, expiry=30.0, clock=self.clock)
+
+    def tearDown(self):
+        asyncio.set_event_loop(None)
+        self.loop.close()
+
+    def next_frame(self, subscription):
+        return json.loads(self.loop.run_until_complete(subscription.get()))
+
+    def test_full_snapshot_then_changed_rows(self):
+        self.broadcaster.publish([metric("lb1", "api", 1), metric("lb1", "web", 2), metric("lb2", "api", 3)])
+        subscription = self.broadcaster.subscribe()
+        frame = self.next_frame(subscription)
+        self.assertEqual("snapshot", frame['type'])
+        self.assertEqual(3, len(frame['rows']))
+
+        self.broadcaster.publish([metric("lb1", "api", 5), metric("lb1", "web", 2)])
+        self.broadcaster.publish([metric("lb1", "api", 5)])
+        frame = self.next_frame(subscription)
+        self.assertEqual("update", frame['type'])
+        self.assertEqual("lb1", frame['server_id'])
+        self.assertEqual([("api", 5)], [(row['backend'], row['sessions']) for row in frame['rows']])
+        self.assertEqual([], frame['removed'])
+        frame = self.next_frame(subscription)
+        self.assertEqual([], frame['rows'])
+        self.assertEqual(["web"], frame['removed'])
+        self.assertFalse(subscription.pending)
+
+    def test_filters_and_shared_frames(self):
+        by_server = self.broadcaster.subscribe(servers=["lb2"])
+        by_backend1 = self.broadcaster.subscribe(backends=["web"])
+        by_backend2 = self.broadcaster.subscribe(backends=["web"])
+        for subscription in (by_server, by_backend1, by_backend2):
+            self.assertEqual([], self.next_frame(subscription)['rows'])
+
+        self.broadcaster.publish([metric("lb1", "api", 1), metric("lb1", "web", 2)])
+        self.assertFalse(by_server.pending)
+        self.assertEqual(1, len(by_backend1.pending))
+        self.assertIs(by_backend1.pending[0], by_backend2.pending[0])
+        self.assertEqual(["web"], [row['backend'] for row in self.next_frame(by_backend1)['rows']])
+
+        # unchanged rows produce no frames
+        self.broadcaster.publish([metric("lb1", "api", 1), metric("lb1", "web", 2)])
+        self.assertEqual(1, len(by_backend2.pending))
+
+    def test_slow_consumers_are_coalesced(self):
+        subscription = self.broadcaster.subscribe()
+        self.next_frame(subscription)
+        for sessions in range(10):
+            self.broadcaster.publish([metric("lb1", "api", sessions)])
+        self.assertEqual(1, subscription.coalesced)
+        frame = self.next_frame(subscription)
+        self.assertEqual("snapshot", frame['type'])
+        self.assertEqual(9, frame['rows'][0]['sessions'])
+
+        subscription.close()
+        self.assertNotIn(subscription, self.broadcaster.subscriptions)
+
+    def test_servers_that_stop_publishing_expire(self):
+        self.broadcaster.publish([metric("lb1", "api", 1), metric("lb1", "web", 2), metric("lb2", "api", 3)])
+        subscription = self.broadcaster.subscribe()
+        self.next_frame(subscription)
+
+        self.clock.now = 20.0
+        self.broadcaster.publish([metric("lb2", "api", 3)])
+        self.assertFalse(subscription.pending)
+        self.clock.now = 31.0
+        self.broadcaster.publish([metric("lb2", "api", 4)])
+        frame = self.next_frame(subscription)
+        self.assertEqual("lb1", frame['server_id'])
+        self.assertEqual([], frame['rows'])
+        self.assertEqual(["api", "web"], sorted(frame['removed']))
+        self.assertEqual("lb2", self.next_frame(subscription)['server_id'])
+
+        self.assertEqual(["lb2"], list(self.broadcaster.rows.keys()))
+        self.assertEqual(["lb2"], [row['server_id'] for row in self.next_frame(self.broadcaster.subscribe())['rows']])
@@ -166,6 +166,165 @@ servers:
             - logfile1
 """
 
+CASE_INVALID_AGGREGATE_CONFIG = """backends:
+    graylog1:
+        type: gelf
+        host: logbroker.local
+        port: 12201
+        facility: test
+    fleet1:
+        type: aggregate
+        backends:
+            - some-unknown-backend
+
+servers:
+    server1:
+        endpoint: "http://server1:8080/haproxy?stats;csv"
+        backends:
+            - fleet1
+"""
+
+CASE_VALID_AGGREGATE_CONFIG = """backends:
+    graylog1:
+        type: gelf
+        host: logbroker.local
+        port: 12201
+        facility: test
+    fleet1:
+        type: aggregate
+        update-interval: 5
+        backends:
+            - graylog1
+
+servers:
+    server1:
+        endpoint: "http://server1:8080/haproxy?stats;csv"
+        backends:
+            - fleet1
+    server2:
+        endpoint: "http://server2:8080/haproxy?stats;csv"
+        backends:
+            - fleet1
+"""
+
+CASE_INVALID_SUMMARY_CONFIG = """backends:
+    logfile1:
+        type: logfile
+        path: /var/log/session-count.log
+    summary1:
+        type: summary
+        quantiles:
+            - 1.5
+        backends:
+            - logfile1
+
+servers:
+    server1:
+        endpoint: "http://server1:8080/haproxy?stats;csv"
+        backends:
+            - summary1
+"""
+
+CASE_VALID_MULTI_PROCESS_CONFIG = """backends:
+    logfile1:
+        type: logfile
+        path: /var/log/session-count.log
+
+servers:
+    server1:
+        endpoints:
+            - "http://server1:8001/haproxy?stats;csv"
+            - "unix:///var/run/haproxy-2.sock"
+        backends:
+            - logfile1
+"""
+
+CASE_INVALID_MULTI_PROCESS_CONFIG = """backends:
+    logfile1:
+        type: logfile
+        path: /var/log/session-count.log
+
+servers:
+    server1:
+        endpoint: "http://server1:8001/haproxy?stats;csv"
+        endpoints:
+            - "http://server1:8002/haproxy?stats;csv"
+        backends:
+            - logfile1
+"""
+
+CASE_VALID_DISCOVER_CONFIG = """backends:
+    logfile1:
+        type: logfile
+        path: /var/log/session-count.log
+
+servers:
+    fleet1:
+        discover:
+            name: haproxy.service.local
+            port: 8080
+        backends:
+            - logfile1
+    fleet2:
+        discover:
+            name: _stats._tcp.haproxy.service.local
+            type: SRV
+        backends:
+            - logfile1
+"""
+
+CASE_INVALID_DISCOVER_CONFIG = """backends:
+    logfile1:
+        type: logfile
+        path: /var/log/session-count.log
+
+servers:
+    fleet1:
+        discover:
+            name: haproxy.service.local
+        backends:
+            - logfile1
+"""
+
+CASE_VALID_ALERTS_CONFIG = """backends:
+    logfile1:
+        type: logfile
+        path: /var/log/session-count.log
+
+servers:
+    server1:
+        endpoint: "http://server1:8080/haproxy?stats;csv"
+        backends:
+            - logfile1
+
+alerts:
+    api-queue:
+        backend: "api*"
+        condition: "queued_sessions > 50"
+        for: 3
+        clear-condition: "queued_sessions < 40"
+        backends:
+            - logfile1
+"""
+
+CASE_INVALID_ALERTS_CONFIG = """backends:
+    logfile1:
+        type: logfile
+        path: /var/log/session-count.log
+
+servers:
+    server1:
+        endpoint: "http://server1:8080/haproxy?stats;csv"
+        backends:
+            - logfile1
+
+alerts:
+    api-queue:
+        condition: "queued_sessions is high"
+        backends:
+            - logfile1
+"""
+
 
 class TestConfig(unittest.TestCase):
 
@@ -214,3 +373,56 @@ class TestConfig(unittest.TestCase):
         self.assertIn('logging', config)
         self.assertIn('backends', config)
         self.assertIn('servers', config)
+
+    def test_aggregate_backend_validation(self):
+        with self.assertRaises(ConfigError):
+            load_haproxysessionmon_config(CASE_INVALID_AGGREGATE_CONFIG)
+
+        config = load_haproxysessionmon_config(CASE_VALID_AGGREGATE_CONFIG)
+        self.assertEqual(5.0, config['backends']['fleet1']['update-interval'])
+        self.assertEqual(15.0, config['backends']['fleet1']['expiry'])
+        self.assertEqual("fleet1", config['backends']['fleet1']['id'])
+
+    def test_summary_backend_validation(self):
+        with self.assertRaises(ConfigError):
+            load_haproxysessionmon_config(CASE_INVALID_SUMMARY_CONFIG)
+        for invalid in ["max-bins: 0", "quantiles: [0.5, 0.5]", "quantiles: [1e-7]"]:
+            with self.assertRaises(ConfigError):
+                load_haproxysessionmon_config(CASE_INVALID_SUMMARY_CONFIG.replace(
+                    "quantiles:\n            - 1.5",
+                    invalid
+                ))
+
+    def test_server_endpoints_validation(self):
+        with self.assertRaises(ConfigError):
+            load_haproxysessionmon_config(CASE_INVALID_MULTI_PROCESS_CONFIG)
+
+        config = load_haproxysessionmon_config(CASE_VALID_MULTI_PROCESS_CONFIG)
+        self.assertEqual(2, len(config['servers']['server1']['endpoints']))
+        config = load_haproxysessionmon_config(CASE_SIMPLE_VALID_CONFIG)
+        self.assertEqual(["http://server1:8080/haproxy?stats;csv"], config['servers']['server1']['endpoints'])
+
+    def test_server_discovery_validation(self):
+        with self.assertRaises(ConfigError):
+            load_haproxysessionmon_config(CASE_INVALID_DISCOVER_CONFIG)
+        with self.assertRaises(ConfigError):
+            load_haproxysessionmon_config(CASE_VALID_DISCOVER_CONFIG.replace(
+                "port: 8080", "port: 8080\n            min-ttl: 60\n            max-ttl: 30"
+            ))
+
+        config = load_haproxysessionmon_config(CASE_VALID_DISCOVER_CONFIG)
+        self.assertEqual("A", config['servers']['fleet1']['discover']['type'])
+        self.assertEqual(8080, config['servers']['fleet1']['discover']['port'])
+        self.assertIsNone(config['servers']['fleet2']['discover']['port'])
+
+    def test_alerts_validation(self):
+        with self.assertRaises(ConfigError):
+            load_haproxysessionmon_config(CASE_INVALID_ALERTS_CONFIG)
+        with self.assertRaises(ConfigError):
+            load_haproxysessionmon_config(CASE_VALID_ALERTS_CONFIG.replace("type: logfile", "type: shm"))
+
+        config = load_haproxysessionmon_config(CASE_VALID_ALERTS_CONFIG)
+        self.assertEqual(3, config['alerts']['api-queue']['for'])
+        self.assertEqual(3, config['alerts']['api-queue']['clear-for'])
+        self.assertEqual("*", config['alerts']['api-queue']['server'])
+        self.assertEqual({}, load_haproxysessionmon_config(CASE_SIMPLE_VALID_CONFIG)['alerts'])
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+
+import socket
+import struct
+import asyncio
+import unittest
+from collections import namedtuple
+
+import aiodns
+
+from haproxysessionmon.discovery import *
+from haproxysessionmon.tests.helpers import FakeClock
+
+
+HostResult = namedtuple("HostResult", ["host", "ttl"])
+SRVResult = namedtuple("SRVResult", ["host", "port", "priority", "weight", "ttl"])
+
+
+class StubResolver(object):
+    """Stands in for an aiodns.DNSResolver, answering queries from a local table of records."""
+
+    def __init__(self, records):
+        self.records = records
+        self.queries = []
+
+    async def query(self, name, query_type):
+        self.queries.append((name, query_type))
+        if (name, query_type) not in self.records:
+            raise aiodns.error.DNSError(4, "Domain name not found")
+        return self.records[(name, query_type)]
+
+
+def encode_name(name):
+    return b"".join(bytes([len(label)]) + label.encode("ascii") for label in name.split(".")) + b"\x00"
+
+
+class LocalDNSResponder(asyncio.DatagramProtocol):
+    """A minimal UDP DNS server answering A and SRV queries from a local table of records, so that a real
+    aiodns.DNSResolver can be pointed at 127.0.0.1."""
+
+    QUERY_TYPES = {1: "A", 33: "SRV"}
+
+    def __init__(self, records):
+        self.records = records
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        query_id, = struct.unpack("!H", data[:2])
+        offset, labels = 12, []
+        while data[offset]:
+            labels.append(data[offset + 1:offset + 1 + data[offset]].decode("ascii"))
+            offset += 1 + data[offset]
+        query_type, = struct.unpack("!H", data[offset + 1:offset + 3])
+        question = data[12:offset + 5]
+        records = self.records.get((".".join(labels), self.QUERY_TYPES.get(query_type)))
+
+        answers = []
+        for record in records or []:
+            if query_type == 1:
+                rdata = socket.inet_aton(record.host)
+            else:
+                rdata = struct.pack("!HHH", record.priority, record.weight, record.port) + encode_name(record.host)
+            # the answer's name points back at the question's name
+            answers.append(struct.pack("!HHHIH", 0xc00c, query_type, 1, record.ttl, len(rdata)) + rdata)
+        # flags: a recursive response, with an NXDOMAIN response code for unknown names
+        flags = 0x8180 if records is not None else 0x8183
+        header = struct.pack("!HHHHHH", query_id, flags, 1, len(answers), 0, 0)
+        self.transport.sendto(header + question + b"".join(answers), addr)
+
+
+class FakeMonitor(object):
+
+    def __init__(self, id, endpoint):
+        self.id = id
+        self.endpoint = endpoint
+        self.stopped = False
+
+    async def poll_for_stats(self, client):
+        await asyncio.sleep(3600)
+
+    def stop(self):
+        self.stopped = True
+
+
+class FailingMonitor(FakeMonitor):
+    """Fails on its first poll, as a monitor does when its server refuses connections."""
+
+    created = 0
+
+    def __init__(self, id, endpoint):
+        super(FailingMonitor, self).__init__(id, endpoint)
+        FailingMonitor.created += 1
+        self.fail = FailingMonitor.created == 1
+
+    async def poll_for_stats(self, client):
+        if self.fail:
+            raise ConnectionRefusedError("Connection refused")
+        await super(FailingMonitor, self).poll_for_stats(client)
+
+
+class TestDNSResolverCache(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.clock = FakeClock()
+        self.stub = StubResolver({
+            ("lb.local", "A"): [HostResult("10.0.0.2", 30), HostResult("10.0.0.1", 60)],
+            ("_stats._tcp.lb.local", "SRV"): [SRVResult("lb1.local", 8081, 0, 0, 1)]
+        })
+        self.resolver = DNSResolverCache(resolver=self.stub, min_ttl=5.0, max_ttl=300.0, clock=self.clock)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def resolve(self, name, query_type):
+        return self.loop.run_until_complete(self.resolver.resolve(name, query_type))
+
+    def test_results_cached_for_ttl(self):
+        self.assertEqual(([("10.0.0.1", None), ("10.0.0.2", None)], 30.0), self.resolve("lb.local", "A"))
+        self.clock.now = 29.0
+        self.assertEqual(1.0, self.resolve("lb.local", "A")[1])
+        self.assertEqual(1, len(self.stub.queries))
+        self.clock.now = 30.0
+        self.resolve("lb.local", "A")
+        self.assertEqual(2, len(self.stub.queries))
+
+    def test_srv_records_and_minimum_ttl(self):
+        self.assertEqual(([("lb1.local", 8081)], 5.0), self.resolve("_stats._tcp.lb.local", "SRV"))
+
+    def test_failures_keep_previous_addresses(self):
+        self.assertEqual(([], 5.0), self.resolve("missing.local", "A"))
+        addresses, _ = self.resolve("lb.local", "A")
+        del self.stub.records[("lb.local", "A")]
+        self.clock.now = 60.0
+        self.assertEqual((addresses, 5.0), self.resolve("lb.local", "A"))
+
+
+class TestDNSResolverCacheWithLocalServer(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.transport, _ = self.loop.run_until_complete(self.loop.create_datagram_endpoint(
+            lambda: LocalDNSResponder({
+                ("lb.local", "A"): [HostResult("10.0.0.2", 30), HostResult("10.0.0.1", 60)],
+                ("_stats._tcp.lb.local", "SRV"): [SRVResult("lb1.local", 8081, 0, 0, 1)]
+            }),
+            local_addr=("127.0.0.1", 0)
+        ))
+        port = self.transport.get_extra_info("sockname")[1]
+        resolver = aiodns.DNSResolver(nameservers=["127.0.0.1"], loop=self.loop, udp_port=port, tries=1,
+                                      timeout=2.0)
+        self.resolver = DNSResolverCache(resolver=resolver, min_ttl=5.0, max_ttl=300.0, clock=FakeClock())
+
+    def tearDown(self):
+        self.transport.close()
+        self.loop.run_until_complete(asyncio.sleep(0))
+        self.loop.close()
+
+    def resolve(self, name, query_type):
+        return self.loop.run_until_complete(self.resolver.resolve(name, query_type))
+
+    def test_a_records(self):
+        self.assertEqual(([("10.0.0.1", None), ("10.0.0.2", None)], 30.0), self.resolve("lb.local", "A"))
+
+    def test_srv_records(self):
+        self.assertEqual(([("lb1.local", 8081)], 5.0), self.resolve("_stats._tcp.lb.local", "SRV"))
+
+    def test_unknown_names(self):
+        with self.assertLogs("haproxysessionmon.discovery", level="ERROR"):
+            self.assertEqual(([], 5.0), self.resolve("missing.local", "A"))
+
+
+class TestDiscoveredServerMonitor(unittest.TestCase):
+
+    def test_monitors_follow_resolved_addresses(self):
+        loop = asyncio.new_event_loop()
+        clock = FakeClock()
+        stub = StubResolver({("lb.local", "A"): [HostResult("10.0.0.1", 10), HostResult("fd00::1", 10)]})
+        monitor = DiscoveredServerMonitor("fleet", DNSResolverCache(resolver=stub, clock=clock), "lb.local",
+                                          FakeMonitor, port=8080)
+
+        self.assertEqual(10.0, loop.run_until_complete(monitor.refresh(None)))
+        self.assertEqual(
+            {"http://10.0.0.1:8080/haproxy?stats;csv", "http://[fd00::1]:8080/haproxy?stats;csv"},
+            set(monitor.monitors.keys())
+        )
+        first, _ = monitor.monitors["http://10.0.0.1:8080/haproxy?stats;csv"]
+        self.assertEqual("fleet/10.0.0.1:8080", first.id)
+
+        stub.records[("lb.local", "A")] = [HostResult("fd00::1", 10), HostResult("10.0.0.3", 10)]
+        clock.now = 10.0
+        loop.run_until_complete(monitor.refresh(None))
+        self.assertEqual(
+            {"http://10.0.0.3:8080/haproxy?stats;csv", "http://[fd00::1]:8080/haproxy?stats;csv"},
+            set(monitor.monitors.keys())
+        )
+        self.assertTrue(first.stopped)
+
+        monitor.retire(list(monitor.monitors.keys()))
+        loop.run_until_complete(asyncio.sleep(0))
+        loop.close()
+
+    def test_failed_monitors_are_restarted(self):
+        loop = asyncio.new_event_loop()
+        stub = StubResolver({("lb.local", "A"): [HostResult("10.0.0.1", 10)]})
+        monitor = DiscoveredServerMonitor("fleet", DNSResolverCache(resolver=stub), "lb.local", FailingMonitor,
+                                          port=8080, restart_delay=0.0)
+        endpoint = "http://10.0.0.1:8080/haproxy?stats;csv"
+
+        loop.run_until_complete(monitor.refresh(None))
+        failed, _ = monitor.monitors[endpoint]
+        with self.assertLogs("haproxysessionmon.discovery", level="ERROR"):
+            loop.run_until_complete(asyncio.sleep(0.01))
+        restarted, task = monitor.monitors[endpoint]
+        self.assertIsNot(failed, restarted)
+        self.assertEqual("fleet/10.0.0.1:8080", restarted.id)
+        self.assertFalse(task.done())
+
+        monitor.retire([endpoint])
+        loop.run_until_complete(asyncio.sleep(0))
+        loop.close()
+
+    def test_replay_monitor(self):
+        monitor = DiscoveredServerMonitor("fleet", DNSResolverCache(resolver=StubResolver({})), "lb.local",
+                                          FakeMonitor, port=8080)
+        replayed = monitor.replay_monitor("fleet/fd00::1:8080")
+        self.assertEqual("http://[fd00::1]:8080/haproxy?stats;csv", replayed.endpoint)
+        self.assertIs(replayed, monitor.replay_monitor("fleet/fd00::1:8080"))
+        self.assertIsNone(monitor.replay_monitor("other/10.0.0.1:8080"))
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import os
+import shutil
+import tempfile
+import unittest
+
+from haproxysessionmon.haproxy import *
+from haproxysessionmon.topk import *
+
+
+STATS_CSV = """# pxname,svname,qcur,qmax,scur,smax,slim,stot,bin,bout,dreq,dresp,ereq,econ,eresp,wretr,wredis,status,weight,act,bck,chkfail,chkdown,lastchg,downtime,qlimit,pid,iid,sid,throttle,lbtot,tracked,type,rate,rate_lim,rate_max,check_status,check_code,check_duration,hrsp_1xx,hrsp_2xx,hrsp_3xx,hrsp_4xx,hrsp_5xx,hrsp_other,hanafail,req_rate,req_rate_max,req_tot,cli_abrt,srv_abrt,
+http-in,FRONTEND,,,3,10,2000,100,0,0,0,0,0,,,,,OPEN,,,,,,,,,1,2,0,,,,0,12,0,20,,,,0,90,0,4,1,0,,12,20,100,,,
+api,api1,0,0,1,5,,50,0,0,,0,,0,0,0,0,UP,1,1,0,0,0,10,0,,1,3,1,,50,,2,4,,8,L4OK,,1,0,40,0,2,1,0,0,,,,0,0,
+api,api2,2,3,2,5,,50,0,0,,0,,0,0,0,0,UP,1,1,0,0,0,10,0,,1,3,2,,50,,2,6,,8,L4OK,,1,0,40,0,1,0,0,0,,,,0,0,
+api,BACKEND,2,3,3,10,200,100,0,0,0,0,,0,0,0,0,UP,2,2,0,,0,10,0,,1,3,0,,100,,1,10,,16,,,,0,80,0,3,1,0,,,,,0,0,
+"""
+
+STATS_CSV_PROCESS2 = """# pxname,svname,qcur,act,rate,hrsp_4xx,hrsp_5xx
+api,BACKEND,1,1,5,2,0
+web,BACKEND,0,3,1,0,0
+"""
+
+
+class TestHAProxyServerMonitor(unittest.TestCase):
+
+    def test_parse_backend_stats(self):
+        monitor = HAProxyServerMonitor("lb1", "http://lb1/stats", [])
+        stats = monitor.parse_csv_stats(STATS_CSV)
+        self.assertEqual(1, len(stats))
+        self.assertEqual(ProxyMetrics("lb1", "http://lb1/stats", "api", 10, 2, 2, 3, 1), stats[0])
+
+    def test_parse_server_stats(self):
+        monitor = HAProxyServerMonitor("lb1", "http://lb1/stats", [], include_servers=True)
+        stats = monitor.parse_csv_stats(STATS_CSV)
+        self.assertEqual(["api/api1", "api/api2", "api"], [metric.backend for metric in stats])
+        self.assertEqual(6, stats[1].sessions)
+        self.assertEqual(2, stats[1].queued_sessions)
+
+    def test_top_k_server_stats(self):
+        monitor = HAProxyServerMonitor("lb1", "http://lb1/stats", [], include_servers=True, top_k=TopKSelector(1))
+        stats = monitor.process_csv_stats(STATS_CSV)
+        self.assertEqual(["api/api2", "api", TOPK_OTHER_SERVER], [metric.backend for metric in stats])
+        # backend rows already include their servers' traffic, so the totals of each kind must match
+        self.assertEqual(10, stats[1].sessions)
+        self.assertEqual(10, stats[0].sessions + stats[2].sessions)
+
+    def test_merge_process_stats(self):
+        monitor = HAProxyServerMonitor("lb1", ["http://lb1:8001/stats", "http://lb1:8002/stats"], [])
+        stats = monitor.process_csv_stats(STATS_CSV, STATS_CSV_PROCESS2)
+        self.assertEqual(
+            [
+                ProxyMetrics("lb1", "http://lb1:8001/stats,http://lb1:8002/stats", "api", 15, 3, 2, 5, 1),
+                ProxyMetrics("lb1", "http://lb1:8001/stats,http://lb1:8002/stats", "web", 1, 0, 3, 0, 0)
+            ],
+            stats
+        )
+
+    def test_failed_process_skips_poll(self):
+        responses = {"http://lb1:8001/stats": STATS_CSV, "http://lb1:8002/stats": STATS_CSV_PROCESS2}
+
+        class PartlyFailingMonitor(HAProxyServerMonitor):
+            async def fetch_endpoint_stats(self, client, endpoint):
+                if endpoint not in responses:
+                    raise ConnectionRefusedError("Connection refused")
+                return responses[endpoint]
+
+        loop = asyncio.new_event_loop()
+        try:
+            monitor = PartlyFailingMonitor("lb1", sorted(responses.keys()), [])
+            self.assertEqual(["api", "web"], [m.backend for m in loop.run_until_complete(monitor.fetch_stats(None))])
+
+            # the remaining processes' stats would under-report the server's totals, so nothing is produced
+            monitor = PartlyFailingMonitor("lb1", sorted(responses.keys()) + ["http://lb1:8003/stats"], [])
+            with self.assertLogs("haproxysessionmon.haproxy", level="WARNING") as logs:
+                self.assertEqual([], loop.run_until_complete(monitor.fetch_stats(None)))
+            self.assertIn("2 of 3 processes responded", "\n".join(logs.output))
+        finally:
+            loop.close()
+
+    def test_fetch_socket_stats(self):
+        tmpdir = tempfile.mkdtemp()
+        path = os.path.join(tmpdir, "haproxy.sock")
+        loop = asyncio.new_event_loop()
+        commands = []
+
+        async def handle(reader, writer):
+            commands.append(await reader.readline())
+            writer.write(STATS_CSV_PROCESS2.encode("utf-8"))
+            await writer.drain()
+            writer.close()
+
+        server = loop.run_until_complete(asyncio.start_unix_server(handle, path))
+        try:
+            monitor = HAProxyServerMonitor("lb1", "unix://" + path, [])
+            stats = loop.run_until_complete(monitor.fetch_stats(None))
+            self.assertEqual([b"show stat\n"], commands)
+            self.assertEqual(["api", "web"], [metric.backend for metric in stats])
+
+            monitor = HAProxyServerMonitor("lb1", "unix://" + os.path.join(tmpdir, "missing.sock"), [])
+            self.assertEqual([], loop.run_until_complete(monitor.fetch_stats(None)))
+        finally:
+            server.close()
+            loop.run_until_complete(server.wait_closed())
+            loop.close()
+            shutil.rmtree(tmpdir)
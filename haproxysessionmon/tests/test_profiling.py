@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from haproxysessionmon.profiling import *
+
+
+def busy_wait(duration):
+    finish = time.monotonic() + duration
+    while time.monotonic() < finish:
+        pass
+
+
+class TestLoopProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+        shutil.rmtree(self.output_dir)
+
+    def test_profile_window(self):
+        profiler = LoopProfiler(self.loop, self.output_dir, sample_interval=0.001, lag_interval=0.01,
+                                lag_threshold=0.02, slowest_ticks=2)
+        profiler.record_tick("lb1", 1.0, 0.5, 0.25, 0.25, time.time())
+        self.assertEqual({}, profiler.ticks)
+
+        async def run():
+            profiler.start()
+            for total in [0.1, 0.3, 0.2]:
+                profiler.record_tick("lb1", total, total / 2, total / 4, total / 4, time.time())
+            await asyncio.sleep(0.02)
+            busy_wait(0.05)
+            await asyncio.sleep(0.02)
+            profiler.toggle()
+
+        with self.assertLogs("haproxysessionmon.profiling", level="WARNING") as logs:
+            self.loop.run_until_complete(run())
+        # the stall is attributed to the code that was blocking the loop
+        self.assertIn("most often in: ", logs.output[0])
+        self.assertTrue(logs.output[0].endswith("test_profiling.py:busy_wait"))
+        self.assertFalse(profiler.active)
+        self.assertGreater(profiler.lag_max, 0.02)
+        self.assertEqual([0.2, 0.3], sorted(timing.total for timing in profiler.ticks["lb1"]))
+
+        files = sorted(os.listdir(self.output_dir))
+        self.assertEqual(2, len(files))
+        with open(os.path.join(self.output_dir, files[0]), "rt") as f:
+            stacks = f.read()
+        self.assertIn("test_profiling.py:busy_wait", stacks)
+        with open(os.path.join(self.output_dir, files[1]), "rt") as f:
+            summary = f.read().splitlines()
+        self.assertEqual("monitor\ttotal\tfetch\tparse\tstore\tstarted", summary[3])
+        self.assertTrue(summary[4].startswith("lb1\t0.3000\t0.1500"))
+
+    def test_stop_outside_loop(self):
+        profiler = LoopProfiler(self.loop, self.output_dir, lag_interval=0.01)
+        for _ in range(2):
+            profiler.start()
+            self.loop.run_until_complete(asyncio.sleep(0.02))
+            profiler.started = 0.0
+            profiler.stop()
+            # the lag probe has finished, so closing the loop leaves nothing pending
+            self.assertTrue(profiler.lag_probe.done())
+
+        # windows started at the same time don't overwrite each other's results
+        self.assertEqual(4, len(os.listdir(self.output_dir)))
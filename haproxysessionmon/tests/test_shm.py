@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from haproxysessionmon.shm import *
+from haproxysessionmon import shm
+from haproxysessionmon.shm import SHM_HEADER_SIZE, SHM_SEQUENCE, SHM_GENERATION_OFFSET
+from haproxysessionmon.tests.helpers import metric
+
+
+class TestSharedSnapshots(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "snapshot.shm")
+        self.writer = SharedSnapshotWriter(self.path, capacity=4)
+        self.reader = SharedSnapshotReader(self.path)
+
+    def tearDown(self):
+        self.reader.close()
+        self.writer.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_publish_and_read(self):
+        self.assertEqual([], self.reader.read())
+        self.writer.publish([metric("lb1", "api", 5, 1, 2, 3, 4), metric("lb1", "web", 6, 1, 2, 3, 4)],
+                            timestamp=100.0)
+        self.writer.publish([metric("lb2", "api", 7, 1, 2, 3, 4)], timestamp=101.0)
+        self.assertEqual(2, self.reader.generation)
+        self.assertEqual(
+            [
+                SharedSnapshotRow("lb1", "api", 100.0, 5, 1, 2, 3, 4),
+                SharedSnapshotRow("lb1", "web", 100.0, 6, 1, 2, 3, 4),
+                SharedSnapshotRow("lb2", "api", 101.0, 7, 1, 2, 3, 4)
+            ],
+            sorted(self.reader.read())
+        )
+
+        # rows disappearing from a server's snapshot are cleared, and their slots reused
+        self.writer.publish([metric("lb1", "api", 8)], timestamp=102.0)
+        self.assertEqual([("lb1", "api", 8), ("lb2", "api", 7)],
+                         sorted((row.server_id, row.backend, row.sessions) for row in self.reader.read()))
+        self.writer.publish([metric("lb3", "api", 1), metric("lb3", "web", 1), metric("lb3", "db", 1)],
+                            timestamp=103.0)
+        self.assertEqual(4, len(self.reader.read()))
+
+    def test_servers_that_stop_publishing_expire(self):
+        # more distinct servers publish over time than there are slots, each only for a while
+        for i in range(10):
+            self.writer.publish([metric("lb{}".format(i), "api", i), metric("lb{}".format(i), "web", i)],
+                                timestamp=100.0 + 40.0 * i)
+            self.assertEqual(
+                {"lb{}".format(j) for j in range(max(0, i - 1), i + 1)},
+                {row.server_id for row in self.reader.read()}
+            )
+        self.assertFalse(self.writer.warned_full)
+        self.assertEqual(["lb8", "lb9"], sorted(self.writer.last_published.keys()))
+
+    def test_torn_reads_are_detected(self):
+        self.writer.publish([metric("lb1", "api", 5)])
+        # simulate a write in progress
+        sequence = SHM_SEQUENCE.unpack_from(self.writer.map, SHM_HEADER_SIZE)[0]
+        SHM_SEQUENCE.pack_into(self.writer.map, SHM_HEADER_SIZE, sequence + 1)
+        self.assertIsNone(self.reader.read_slot(0))
+        SHM_SEQUENCE.pack_into(self.writer.map, SHM_HEADER_SIZE, sequence)
+        self.assertEqual("api", self.reader.read_slot(0).backend)
+
+    def test_missing_and_non_integer_values(self):
+        self.writer.publish([metric("lb1", "api", 2.5, http_4xx=None, http_5xx=2 ** 64)])
+        row = self.reader.read()[0]
+        self.assertEqual((2, None, None), (row.sessions, row.http_4xx, row.http_5xx))
+        self.assertEqual(1, self.reader.generation)
+
+    def test_snapshots_being_published_are_not_read(self):
+        self.writer.publish([metric("lb1", "api", 5)])
+        # simulate a snapshot being published
+        SHM_SEQUENCE.pack_into(self.writer.map, SHM_GENERATION_OFFSET, 3)
+        attempts = shm.SHM_SNAPSHOT_ATTEMPTS
+        shm.SHM_SNAPSHOT_ATTEMPTS = 3
+        try:
+            with self.assertRaises(RuntimeError):
+                self.reader.read()
+        finally:
+            shm.SHM_SNAPSHOT_ATTEMPTS = attempts
+        SHM_SEQUENCE.pack_into(self.writer.map, SHM_GENERATION_OFFSET, 4)
+        self.assertEqual(1, len(self.reader.read()))
+
+    def test_invalid_file(self):
+        path = os.path.join(self.tmpdir, "other")
+        with open(path, "wb") as f:
+            f.write(b"\x00" * 128)
+        with self.assertRaises(ValueError):
+            SharedSnapshotReader(path)
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+import random
+import unittest
+
+from haproxysessionmon.sketches import *
+
+
+class TestQuantileSketch(unittest.TestCase):
+
+    def assertWithinAccuracy(self, expected, actual, accuracy=0.01):
+        self.assertLessEqual(abs(actual - expected), expected * accuracy + 1e-9)
+
+    def test_quantiles(self):
+        sketch = QuantileSketch(relative_accuracy=0.01)
+        values = list(range(1, 10001))
+        random.Random(42).shuffle(values)
+        for value in values:
+            sketch.add(value)
+        self.assertEqual(10000, sketch.count)
+        self.assertWithinAccuracy(5000, sketch.quantile(0.5))
+        self.assertWithinAccuracy(9500, sketch.quantile(0.95))
+        self.assertWithinAccuracy(9900, sketch.quantile(0.99))
+        self.assertEqual(1, sketch.quantile(0.0))
+        self.assertEqual(10000, sketch.quantile(1.0))
+
+    def test_zeroes_and_empty(self):
+        sketch = QuantileSketch()
+        self.assertIsNone(sketch.quantile(0.5))
+        for value in [0, 0, 0, 10]:
+            sketch.add(value)
+        self.assertEqual(0, sketch.quantile(0.5))
+        self.assertEqual(10, sketch.quantile(1.0))
+        with self.assertRaises(ValueError):
+            sketch.add(-1)
+
+    def test_merge(self):
+        left, right, combined = QuantileSketch(), QuantileSketch(), QuantileSketch()
+        for value in range(1, 1001):
+            (left if value % 2 else right).add(value)
+            combined.add(value)
+        merged = QuantileSketch.from_dict(left.to_dict()).merge(right)
+        self.assertEqual(combined.to_dict(), merged.to_dict())
+        with self.assertRaises(ValueError):
+            merged.merge(QuantileSketch(relative_accuracy=0.05))
+
+    def test_memory_is_bounded(self):
+        sketch = QuantileSketch(relative_accuracy=0.01, max_bins=64)
+        for exponent in range(200):
+            sketch.add(1.1 ** exponent)
+        self.assertLessEqual(len(sketch.bins), 64)
+        self.assertEqual(200, sketch.count)
+        self.assertWithinAccuracy(1.1 ** 199, sketch.quantile(1.0))
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import json
+import unittest
+
+from haproxysessionmon.broadcast import SnapshotBroadcaster
+from haproxysessionmon.backends.stream import stream_websocket, stream_events
+from haproxysessionmon.tests.helpers import metric
+
+
+class SlowConnection(object):
+    """Stands in for a WebSocket or SSE response whose client is not reading, so that draining blocks until
+    the test releases it."""
+
+    def __init__(self):
+        self.closed = False
+        self.sent = []
+        self.flushed = asyncio.Event()
+
+    def send_str(self, data):
+        self.sent.append(data)
+
+    def write(self, data):
+        self.sent.append(data.decode("utf-8")[len("data: "):].strip())
+
+    async def drain(self):
+        await self.flushed.wait()
+
+
+class TestStreamHandlers(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.broadcaster = SnapshotBroadcaster(max_pending=2)
+        self.broadcaster.publish([metric("lb1", "api", 1)])
+        self.subscription = self.broadcaster.subscribe()
+        self.connection = SlowConnection()
+
+    def tearDown(self):
+        asyncio.set_event_loop(None)
+        self.loop.close()
+
+    def settle(self):
+        self.loop.run_until_complete(asyncio.sleep(0.01))
+
+    def check_slow_subscriber_coalesced(self):
+        self.settle()
+        # the initial snapshot is waiting to be drained, so updates queue up in the subscription
+        self.assertEqual(1, len(self.connection.sent))
+        for sessions in range(2, 7):
+            self.broadcaster.publish([metric("lb1", "api", sessions)])
+        self.settle()
+        self.assertEqual(1, len(self.connection.sent))
+        self.assertEqual(1, self.subscription.coalesced)
+
+        # once the client catches up, it receives a single fresh snapshot
+        self.connection.flushed.set()
+        self.settle()
+        self.assertEqual(2, len(self.connection.sent))
+        frame = json.loads(self.connection.sent[1])
+        self.assertEqual("snapshot", frame['type'])
+        self.assertEqual(6, frame['rows'][0]['sessions'])
+
+    def test_websocket_backpressure(self):
+        receiver = self.loop.create_future()
+        task = self.loop.create_task(stream_websocket(self.connection, self.subscription, receiver))
+        self.check_slow_subscriber_coalesced()
+
+        # the subscriber disconnecting ends the stream
+        receiver.set_result(None)
+        self.loop.run_until_complete(task)
+
+    def test_events_backpressure(self):
+        task = self.loop.create_task(stream_events(self.connection, self.subscription))
+        self.check_slow_subscriber_coalesced()
+
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            self.loop.run_until_complete(task)
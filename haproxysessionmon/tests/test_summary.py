@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import unittest
+
+from haproxysessionmon.haproxy import ProxyMetrics
+from haproxysessionmon.backends.summary import *
+from haproxysessionmon.tests.helpers import *
+
+
+class TestSummaryBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.clock = FakeClock()
+        self.target = MemoryBackend()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def run_window(self, summary, servers):
+        for tick in range(60):
+            self.clock.now = float(tick)
+            stats = [
+                ProxyMetrics(server_id, "http://{}/stats".format(server_id), "api", tick + 1, 0, 2, tick, 0)
+                for server_id in servers
+            ]
+            self.loop.run_until_complete(summary.store_stats(stats))
+        self.clock.now = 60.0
+        self.loop.run_until_complete(summary.store_stats([]))
+
+    def test_summary_per_server(self):
+        summary = SummaryBackend("summary", [self.target], window=60.0, clock=self.clock)
+        self.run_window(summary, ["lb1", "lb2"])
+        self.assertEqual(1, len(self.target.stored))
+        rows = self.target.stored[0]
+        self.assertEqual([("lb1", "api"), ("lb2", "api")], [(row.server_id, row.backend) for row in rows])
+        self.assertEqual(60, rows[0].samples)
+        self.assertEqual(60, rows[0].sessions)
+        self.assertEqual(59, rows[0].http_4xx)
+        self.assertAlmostEqual(30, rows[0].sessions_p50, delta=1)
+        self.assertAlmostEqual(57, rows[0].sessions_p95, delta=1)
+        self.assertEqual(2, rows[0].active_backends_p99)
+
+    def test_summary_merging_servers(self):
+        summary = SummaryBackend("fleet", [self.target], window=60.0, quantiles=[0.5, 0.999], merge_servers=True,
+                                 clock=self.clock)
+        self.run_window(summary, ["lb1", "lb2"])
+        rows = self.target.stored[0]
+        self.assertEqual(1, len(rows))
+        self.assertEqual("fleet", rows[0].server_id)
+        self.assertEqual(120, rows[0].samples)
+        self.assertIsNone(rows[0].http_4xx)
+        self.assertAlmostEqual(60, rows[0].sessions_p99_9, delta=1)
+
+    def test_merging_emitted_sketches(self):
+        workers = [MemoryBackend(), MemoryBackend()]
+        for target, servers in zip(workers, [["lb1"], ["lb2", "lb3"]]):
+            self.run_window(SummaryBackend("worker", [target], window=60.0, merge_servers=True, clock=self.clock),
+                            servers)
+        self.run_window(SummaryBackend("fleet", [self.target], window=60.0, merge_servers=True, clock=self.clock),
+                        ["lb1", "lb2", "lb3"])
+        combined = self.target.rows[0]
+
+        merged = merge_summary_sketches([worker.rows[0] for worker in workers])
+        self.assertEqual(set(SUMMARISED_FIELDS), set(merged.keys()))
+        self.assertEqual(combined.samples, merged["sessions"].count)
+        self.assertEqual(combined.sessions_p50, merged["sessions"].quantile(0.5))
+        self.assertEqual(combined.sessions_p99, merged["sessions"].quantile(0.99))
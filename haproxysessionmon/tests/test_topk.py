@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from haproxysessionmon.topk import *
+from haproxysessionmon.tests.helpers import metric
+
+
+class TestTopKSelector(unittest.TestCase):
+
+    def test_selects_hottest_rows_and_other(self):
+        stats = [metric("lb1", "b{}".format(i), i) for i in range(100)]
+        result = TopKSelector(3).select(iter(stats))
+        self.assertEqual(["b97", "b98", "b99", TOPK_OTHER_BACKEND], [m.backend for m in result])
+        other = result[-1]
+        self.assertEqual(sum(range(97)), other.sessions)
+        self.assertEqual(97, other.active_backends)
+
+    def test_union_of_metrics(self):
+        stats = [
+            metric("lb1", "a", 10),
+            metric("lb1", "b", 1, queued_sessions=5),
+            metric("lb1", "c", 2, http_5xx=7),
+            metric("lb1", "d", 3)
+        ]
+        result = TopKSelector(1, metrics=("sessions", "queued_sessions", "http_5xx")).select(stats)
+        self.assertEqual(["a", "b", "c", TOPK_OTHER_BACKEND], [m.backend for m in result])
+        self.assertEqual(3, result[-1].sessions)
+
+    def test_backend_and_server_rows_ranked_separately(self):
+        stats = [
+            metric("lb1", "api/api1", 4),
+            metric("lb1", "api/api2", 6),
+            metric("lb1", "api", 10),
+            metric("lb1", "web/web1", 1),
+            metric("lb1", "web", 1)
+        ]
+        result = TopKSelector(1).select(stats)
+        self.assertEqual(["api/api2", "api", TOPK_OTHER_BACKEND, TOPK_OTHER_SERVER], [m.backend for m in result])
+        self.assertEqual([1, 5], [m.sessions for m in result[2:]])
+
+    def test_no_other_row_when_everything_selected(self):
+        stats = [metric("lb1", "a", 1), metric("lb1", "b", 2)]
+        self.assertEqual(stats, TopKSelector(5).select(stats))
+        self.assertEqual([], TopKSelector(5).select([]))
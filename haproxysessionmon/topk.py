@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+import heapq
+
+__all__ = [
+    "TopKSelector",
+    "TOPK_METRICS",
+    "TOPK_OTHER_BACKEND",
+    "TOPK_OTHER_SERVER"
+]
+
+# metrics by which rows can be ranked, and which are summed into the "other" row
+TOPK_METRICS = (
+    "sessions",
+    "queued_sessions",
+    "active_backends",
+    "http_4xx",
+    "http_5xx"
+)
+
+# HAProxy only allows letters, digits and "-_.:" in proxy and server names, so these can never clash with
+# the name of a real backend or server
+TOPK_OTHER_BACKEND = "(other)"
+TOPK_OTHER_SERVER = "(other)/(other)"
+
+
+def is_server_row(metric):
+    # per-server rows are named "<backend>/<server>" (see HAProxyServerMonitor.iter_csv_stats)
+    return "/" in metric.backend
+
+
+class TopKGroup(object):
+    """The running top-K state for rows of a single kind (backends or servers)."""
+
+    def __init__(self, size, metrics, other_name):
+        self.size = size
+        self.metrics = metrics
+        self.other_name = other_name
+        self.heaps = [[] for _ in metrics]
+        self.totals = [0] * len(TOPK_METRICS)
+        self.count = 0
+        self.template = None
+
+    def add(self, seq, metric):
+        if self.template is None:
+            self.template = metric
+        self.count += 1
+        for i, field in enumerate(TOPK_METRICS):
+            self.totals[i] += getattr(metric, field)
+        for heap, field in zip(self.heaps, self.metrics):
+            # the sequence number breaks ties, and keeps rows themselves out of comparisons
+            entry = (getattr(metric, field), seq, metric)
+            if len(heap) < self.size:
+                heapq.heappush(heap, entry)
+            elif entry[0] > heap[0][0]:
+                heapq.heapreplace(heap, entry)
+
+    def selected(self):
+        selected = dict()
+        for heap in self.heaps:
+            for _, seq, metric in heap:
+                selected[seq] = metric
+        return selected
+
+    def other(self, selected):
+        """Returns a row summing the values of the rows which were not selected, or None if all of them
+        were."""
+        if self.count == len(selected):
+            return None
+        totals = list(self.totals)
+        for metric in selected.values():
+            for i, field in enumerate(TOPK_METRICS):
+                totals[i] -= getattr(metric, field)
+        return self.template._replace(backend=self.other_name, **dict(zip(TOPK_METRICS, totals)))
+
+
+class TopKSelector(object):
+    """Selects the K hottest rows by one or more metrics from a stream of metrics, summarising the remaining
+    rows into a single "other" row. Backend rows and per-server rows are ranked and summarised separately,
+    since each backend row already includes the traffic of its servers. Memory usage is bounded by K (per
+    metric), rather than by the number of rows in the stream."""
+
+    def __init__(self, size, metrics=("sessions",)):
+        """Constructor.
+
+        Args:
+            size: The number of rows (K) to keep for each metric, of each kind of row.
+            metrics: The names of the metrics by which to rank rows. A row is kept if it is amongst the
+                top K rows for any one of these metrics.
+        """
+        self.size = size
+        self.metrics = tuple(metrics)
+
+    def select(self, stats):
+        """Selects the top K rows from the given iterable of metrics.
+
+        Args:
+            stats: An iterable of metrics (e.g. from HAProxyServerMonitor.iter_csv_stats).
+
+        Returns:
+            A list containing the selected rows, in the order in which they were encountered, followed by
+            an "other" row for backends and one for servers, summing the values of the rows of that kind
+            that were not selected (if any).
+        """
+        backends = TopKGroup(self.size, self.metrics, TOPK_OTHER_BACKEND)
+        servers = TopKGroup(self.size, self.metrics, TOPK_OTHER_SERVER)
+        for seq, metric in enumerate(stats):
+            (servers if is_server_row(metric) else backends).add(seq, metric)
+
+        result = []
+        others = []
+        for group in (backends, servers):
+            selected = group.selected()
+            result.extend(selected.items())
+            other = group.other(selected)
+            if other is not None:
+                others.append(other)
+        return [metric for _, metric in sorted(result, key=lambda item: item[0])] + others
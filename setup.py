@@ -38,6 +38,7 @@ setup(
     entry_points={
         'console_scripts': [
             'haproxysessionmon = haproxysessionmon.core:main',
+            'haproxysessionmon-shmdump = haproxysessionmon.shm:main',
         ]
     },
     license='MIT',